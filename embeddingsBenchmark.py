@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import subprocess
+import argparse
+import numpy as np
+from utilities.Embeddings import Embeddings
+import sequenceLabelling
+from sequenceLabelling.reader import load_data_and_labels_crf_file, load_data_and_labels_conll
+from sequenceLabelling.data_generator import DataGenerator
+from sequenceLabelling.trainer import Scorer
+from sklearn.model_selection import train_test_split
+import keras.backend as K
+
+# benchmarks of the embeddings management, to be run from the root of DeLFT
+
+grobid_models = ['affiliation-address', 'citation', 'date', 'name-citation', 'name-header']
+quantizations = ['float32', 'float16', 'int8']
+
+# seed of the evaluation split of the GROBID training data, for reproducible scores
+eval_random_state = 7
+
+# run in a new Python process for measuring the cold start of a static embeddings lookup
+startup_script = """
+import sys, time, json
+start = time.time()
+from utilities.Embeddings import Embeddings
+imported = time.time()
+embeddings = Embeddings(sys.argv[1])
+loaded = time.time()
+embeddings.get_word_vector('the')
+looked_up = time.time()
+print(json.dumps({"import": imported - start, "init": loaded - imported, "lookup": looked_up - loaded, 
+    "tensorflow": "tensorflow" in sys.modules}))
+"""
+
+
+def load_eval_data(model_name):
+    """
+    Evaluation data of a bundled model and whether this data was used to train the model, None 
+    if the data is not available
+    """
+    if model_name == 'ner-en-conll2003':
+        path = 'data/sequenceLabelling/CoNLL-2003/eng.testb'
+        if not os.path.isfile(path):
+            return None
+        x_eval, y_eval = load_data_and_labels_conll(path)
+        return x_eval, y_eval, False
+    model = model_name.replace('grobid-', '')
+    path = 'data/sequenceLabelling/grobid/'+model+'/'+model+'-060518.train'
+    if not os.path.isfile(path):
+        return None
+    x_all, y_all, f_all = load_data_and_labels_crf_file(path)
+    # same 10% segmentation as in grobidTagger.py train_eval, with a fixed seed for comparable scores, 
+    # the bundled models being trained on the whole file
+    _, x_eval, _, y_eval = train_test_split(x_all, y_all, test_size=0.1, random_state=eval_random_state)
+    return x_eval, y_eval, True
+
+
+def eval_model(model_name, embeddings, x_eval, y_eval):
+    """
+    Load a model with the given embeddings and return its f1 score on the evaluation data
+    """
+    model = sequenceLabelling.Sequence(model_name)
+    model.load(embeddings=embeddings)
+    test_generator = DataGenerator(x_eval, y_eval, 
+        batch_size=model.training_config.batch_size, preprocessor=model.p, 
+        char_embed_size=model.model_config.char_embedding_size, 
+        embeddings=embeddings, shuffle=False)
+    scorer = Scorer(test_generator, model.p, evaluation=False)
+    scorer.model = model.model
+    scorer.on_epoch_end(epoch=-1)
+    return scorer.f1
+
+
+def store_size(embeddings):
+    """
+    Size in bytes of the compiled embeddings store, None for embeddings loaded in memory, which 
+    have no store on disk
+    """
+    if embeddings.env_path is not None:
+        path = embeddings.env_path
+    elif embeddings.env_index_path is not None:
+        path = os.path.dirname(embeddings.env_index_path)
+    else:
+        return None
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+def benchmark_quantization(embeddings_name):
+    """
+    Compare the size on disk of the embeddings store and the f1 scores of the bundled CoNLL-2003 
+    and GROBID models for the different quantization of the embeddings. The embeddings loaded in 
+    memory are not quantized, so only float32 is then evaluated. 
+    """
+    model_names = ['ner-en-conll2003'] + ['grobid-'+model for model in grobid_models]
+    eval_data = {}
+    for model_name in model_names:
+        data = load_eval_data(model_name)
+        if data is None:
+            print("no evaluation data for model", model_name, "- skipped")
+        else:
+            eval_data[model_name] = data
+
+    sizes = {}
+    scores = {}
+    for quantization in quantizations:
+        print('\n------------------------ quantization:', quantization, '------------------------')
+        embeddings = Embeddings(embeddings_name, quantization=quantization)
+        sizes[quantization] = store_size(embeddings)
+        if quantization != 'float32' and sizes[quantization] is None:
+            # loaded in memory as float32, the scores would be the ones of float32
+            print("embeddings loaded in memory, quantization", quantization, "skipped")
+            continue
+        for model_name, (x_eval, y_eval, _) in eval_data.items():
+            scores[(quantization, model_name)] = eval_model(model_name, embeddings, x_eval, y_eval)
+        K.clear_session()
+
+    print("\nembeddings:", embeddings_name)
+    print("\t{:<12} {:>20} {:>24}".format("quantization", "store size (MB)", "store size vs float32"))
+    for quantization in quantizations:
+        if sizes[quantization] is None or sizes['float32'] is None:
+            print("\t{:<12} {:>20} {:>24}".format(quantization, "in-memory", "-"))
+            continue
+        ratio = sizes[quantization] / float(sizes['float32'])
+        print("\t{:<12} {:>20.1f} {:>23.1f}%".format(quantization, sizes[quantization] / (1024 * 1024), ratio * 100))
+
+    print("\n\t{:<28} {:>8} {:>16} {:>16}".format("model", "f1", "delta float16", "delta int8"))
+    for model_name, (_, _, training_data) in eval_data.items():
+        f1 = scores[('float32', model_name)]
+        deltas = []
+        for quantization in ['float16', 'int8']:
+            if (quantization, model_name) in scores:
+                deltas.append("{:>+16.2f}".format((scores[(quantization, model_name)] - f1) * 100))
+            else:
+                deltas.append("{:>16}".format("-"))
+        print("\t{:<28} {:>8.2f} {} {}{}".format(model_name, f1 * 100, deltas[0], deltas[1], 
+            " (training data)" if training_data else ""))
+    if any(training_data for _, _, training_data in eval_data.values()):
+        print("\n(training data): evaluated on a split (random_state={}) of the data used to train the model, "
+            "the f1 and its deltas are measured on training data".format(eval_random_state))
+
+
+def benchmark_startup(embeddings_name, nb_runs=5, import_budget=1.0):
+    """
+    Measure in new Python processes the time to import utilities.Embeddings, to create the 
+    Embeddings object and to get a first static vector. Return False if the median import time 
+    is above the budget (in seconds). 
+    """
+    runs = []
+    # the first run compiles the embeddings store if necessary, so it is not measured
+    for i in range(nb_runs + 1):
+        output = subprocess.check_output([sys.executable, '-c', startup_script, embeddings_name])
+        if i > 0:
+            # the measures are on the last line, after the messages of the embeddings loading
+            runs.append(json.loads(output.decode('UTF-8').strip().split('\n')[-1]))
+
+    print("\nembeddings:", embeddings_name, "-", nb_runs, "runs")
+    print("\t{:<14} {:>12} {:>12}".format("", "median (s)", "min (s)"))
+    for step in ["import", "init", "lookup"]:
+        times = [run[step] for run in runs]
+        print("\t{:<14} {:>12.3f} {:>12.3f}".format(step, np.median(times), np.min(times)))
+    totals = [run["import"] + run["init"] + run["lookup"] for run in runs]
+    print("\t{:<14} {:>12.3f} {:>12.3f}".format("total", np.median(totals), np.min(totals)))
+    print("\nTensorFlow imported:", any(run["tensorflow"] for run in runs))
+
+    import_time = np.median([run["import"] for run in runs])
+    if import_time > import_budget:
+        print("import time above the budget of", import_budget, "seconds")
+        return False
+    print("import time within the budget of", import_budget, "seconds")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Benchmarks for the management of embeddings")
+
+    parser.add_argument("action", help="one of [quantization,startup]")
+    parser.add_argument("--embedding", default='glove-840B', help="name of the embeddings as in the embeddings registry")
+    parser.add_argument("--runs", type=int, default=5, help="number of measured runs for the startup benchmark")
+    parser.add_argument("--import-budget", type=float, default=1.0, 
+        help="maximum import time in seconds of utilities.Embeddings for the startup benchmark")
+
+    args = parser.parse_args()
+
+    if args.action == 'quantization':
+        benchmark_quantization(args.embedding)
+    elif args.action == 'startup':
+        if not benchmark_startup(args.embedding, nb_runs=args.runs, import_budget=args.import_budget):
+            sys.exit(1)
+    else:
+        print('action not specifed, must be one of [quantization,startup]')
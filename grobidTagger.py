@@ -14,7 +14,7 @@ models = ['affiliation-address', 'citation', 'date', 'header', 'name-citation',
 
 
 # train a GROBID model with all available data 
-def train(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=False): 
+def train(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=False, subset_top_n=None): 
     print('Loading data...')
     x_all, y_all, f_all = load_data_and_labels_crf_file('data/sequenceLabelling/grobid/'+model+'/'+model+'-060518.train')
 
@@ -42,8 +42,12 @@ def train(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=False):
     # saving the model
     model.save()
 
+    # saving the embeddings subset of the model, if requested
+    if subset_top_n is not None:
+        model.save_embeddings_subset(x_all, top_n=subset_top_n)
+
 # split data, train a GROBID model and evaluate it 
-def train_eval(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=False): 
+def train_eval(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=False, subset_top_n=None): 
     print('Loading data...')
     x_all, y_all, f_all = load_data_and_labels_crf_file('data/sequenceLabelling/grobid/'+model+'/'+model+'-060518.train')
 
@@ -77,9 +81,13 @@ def train_eval(model, embeddings_name, architecture='BidLSTM_CRF', use_ELMo=Fals
     # saving the model
     model.save()
 
+    # saving the embeddings subset of the model, if requested
+    if subset_top_n is not None:
+        model.save_embeddings_subset(x_all, top_n=subset_top_n)
+
 # annotate a list of texts, this is relevant only of models taking only text as input 
 # (so not text with layout information) 
-def annotate_text(texts, model, output_format, use_ELMo=False):
+def annotate_text(texts, model, output_format, use_ELMo=False, use_embeddings_subset=False):
     annotations = []
 
     # load model
@@ -87,7 +95,7 @@ def annotate_text(texts, model, output_format, use_ELMo=False):
     if use_ELMo:
         model_name += '-with_ELMo'
     model = sequenceLabelling.Sequence(model_name)
-    model.load()
+    model.load(use_embeddings_subset=use_embeddings_subset)
 
     start_time = time.time()
 
@@ -110,6 +118,10 @@ if __name__ == "__main__":
     parser.add_argument("--fold-count", type=int, default=1)
     parser.add_argument("--architecture",default='BidLSTM_CRF', help="type of model architecture to be used (BidLSTM_CRF, BidLSTM_CNN_CRF or BidLSTM_CNN_CRF)")
     parser.add_argument("--use-ELMo", action="store_true", help="Use ELMo contextual embeddings") 
+    parser.add_argument("--embeddings-subset", action="store_true", 
+        help="save with the model (train) or use (tag) the subset of the embeddings covering the training data")
+    parser.add_argument("--subset-top-n", type=int, default=100000, 
+        help="number of the most frequent words of the embeddings added to the embeddings subset")
 
     args = parser.parse_args()
     
@@ -132,13 +144,17 @@ if __name__ == "__main__":
     # and that the path in the registry to the embedding file is correct on your system
     embeddings_name = "glove-840B"
 
+    subset_top_n = None
+    if args.embeddings_subset:
+        subset_top_n = args.subset_top_n
+
     if action == 'train':
-        train(model, embeddings_name, architecture=architecture, use_ELMo=use_ELMo)
+        train(model, embeddings_name, architecture=architecture, use_ELMo=use_ELMo, subset_top_n=subset_top_n)
     
     if action == 'train_eval':
         if args.fold_count < 1:
             raise ValueError("fold-count should be equal or more than 1")
-        train_eval(model, embeddings_name, architecture=architecture, use_ELMo=use_ELMo)
+        train_eval(model, embeddings_name, architecture=architecture, use_ELMo=use_ELMo, subset_top_n=subset_top_n)
 
     if action == 'tag':
         someTexts = []
@@ -156,7 +172,7 @@ if __name__ == "__main__":
             someTexts.append("He-Jin Wu 1 · Zhao Jin 2 · Ai-Dong Zhu 1")
             someTexts.append("Irène Charon ⋆ and Olivier Hudry")
 
-        result = annotate_text(someTexts, model, "json", use_ELMo=use_ELMo)
+        result = annotate_text(someTexts, model, "json", use_ELMo=use_ELMo, use_embeddings_subset=args.embeddings_subset)
         print(json.dumps(result, sort_keys=False, indent=4, ensure_ascii=False))
 
     # see https://github.com/tensorflow/tensorflow/issues/3388
@@ -18,7 +18,10 @@ class ModelConfig(object):
                  use_crf=True,
                  fold_number=1,
                  batch_size=64,
-                 use_ELMo=False):
+                 use_ELMo=False, 
+                 use_word_index=False, 
+                 word_index_top_n=0, 
+                 dynamic_char_length=False):
 
         self.model_name = model_name
         self.model_type = model_type
@@ -30,6 +33,9 @@ class ModelConfig(object):
         self.char_embedding_size = char_emb_size
         self.num_char_lstm_units = char_lstm_units
         self.max_char_length = max_char_length
+        # if True, the char sequences are padded to the longest word of each batch (capped at 
+        # max_char_length) instead of max_char_length
+        self.dynamic_char_length = dynamic_char_length
 
         self.word_embedding_size = word_embedding_size
         self.num_word_lstm_units = word_lstm_units
@@ -45,6 +51,13 @@ class ModelConfig(object):
 
         self.use_ELMo = use_ELMo
 
+        # if True, the models take word indices as input, looked up in a frozen embedding matrix 
+        # of the vocabulary of the training data extended with the word_index_top_n most frequent 
+        # words of the embeddings, instead of the word embeddings themselves
+        self.use_word_index = use_word_index
+        self.word_index_top_n = word_index_top_n
+        self.word_vocab_size = None
+
     def save(self, file):
         with open(file, 'w') as f:
             json.dump(vars(self), f, sort_keys=False, indent=4)
@@ -71,7 +84,10 @@ class TrainingConfig(object):
                  max_epoch=50, 
                  early_stop=True,
                  patience=5,
-                 max_checkpoints_to_keep=5):
+                 max_checkpoints_to_keep=5, 
+                 materialize_path=None, 
+                 bucket_by_length=False, 
+                 sparse_labels=False):
 
         self.batch_size = batch_size
         self.optimizer = optimizer
@@ -82,4 +98,12 @@ class TrainingConfig(object):
         self.early_stop = early_stop
         self.patience = patience
         self.max_checkpoints_to_keep = max_checkpoints_to_keep
+        # directory where the training and validation data are vectorized once for all the 
+        # epochs, None to vectorize each batch at training time
+        self.materialize_path = materialize_path
+        # batches of sequences of similar lengths, to reduce padding, instead of contiguous slices 
+        # of the data
+        self.bucket_by_length = bucket_by_length
+        # train with tag ids and a sparse loss instead of one-hot tags
+        self.sparse_labels = sparse_labels
         
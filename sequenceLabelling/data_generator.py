@@ -1,14 +1,43 @@
+import os
+import json
+import hashlib
 import numpy as np
 # seed is fixed for reproducibility
 np.random.seed(7)
 import keras
 from sequenceLabelling.preprocess import to_vector_single, to_casing_single, to_vector_elmo, to_vector_simple_with_elmo
+from sequenceLabelling.preprocess import to_vector_batch, to_casing_batch
 from utilities.Tokenizer import tokenizeAndFilterSimple
+from utilities.Embeddings import list_digest
 import tensorflow as tf
 tf.set_random_seed(7)
 
 # generate batch of data to feed sequence labelling model, both for training and prediction
 
+class BatchBuffers(object):
+    """
+    Pool of preallocated arrays reused from one batch to the next, each named buffer growing to 
+    the size of the largest batch (batch size x longest sequence) seen so far. An array returned 
+    by get() is only valid until the next call with the same name, so a batch must be consumed 
+    before the next one is generated. This is not the case with the Keras thread workers nor with 
+    the queue of the Keras enqueuers, so the buffers are used only when the batches are consumed 
+    synchronously (e.g. by predict_on_batch in a loop).
+    """
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype='float32'):
+        'Return a zero array of the given shape, backed by the named buffer'
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != np.dtype(dtype):
+            buffer = np.empty((size,), dtype=dtype)
+            self.buffers[name] = buffer
+        array = buffer[:size].reshape(shape)
+        array.fill(0)
+        return array
+
+
 class DataGenerator(keras.utils.Sequence):
     'Generates data for Keras'
     def __init__(self, x, y, 
@@ -17,7 +46,12 @@ class DataGenerator(keras.utils.Sequence):
                 char_embed_size=25, 
                 embeddings=None, 
                 tokenize=False, 
-                shuffle=True):
+                shuffle=True, 
+                materialize_path=None, 
+                reuse_buffers=False, 
+                bucket_by_length=False, 
+                seed=7, 
+                sparse_labels=False):
         'Initialization'
         self.x = x
         self.y = y
@@ -28,8 +62,33 @@ class DataGenerator(keras.utils.Sequence):
         self.embeddings = embeddings
         self.char_embed_size = char_embed_size
         self.shuffle = shuffle
+        # the order of the samples of an epoch only depends on the seed and the epoch number
+        self.seed = seed
+        self.epoch = 0
         self.tokenize = tokenize
+        # tags as ids of shape (batch size, max length, 1) for the sparse losses, instead of one-hot
+        self.sparse_labels = sparse_labels
+        # batch arrays are filled in place in buffers reused across batches, only valid when each 
+        # batch is consumed before the next one is generated
+        self.buffers = BatchBuffers() if reuse_buffers else None
+        # pre-vectorized data, the batches are then sliced from these arrays
+        self.materialized = None
+        if materialize_path is not None and not tokenize:
+            self.materialized = materialize_dataset(x, y, preprocessor, embeddings, materialize_path, 
+                batch_size=batch_size)
+        # batches of sequences of similar lengths instead of contiguous slices of the data
+        self.bucket_by_length = bucket_by_length
+        self.batch_indices = None
+        if bucket_by_length:
+            if tokenize:
+                self.lengths = np.array([len(tokenizeAndFilterSimple(text)) for text in x], dtype='int64')
+            else:
+                self.lengths = np.array([len(tokens) for tokens in x], dtype='int64')
         self.on_epoch_end()
+        if bucket_by_length:
+            contiguous = [np.arange(start, min(start+batch_size, len(x))) for start in range(0, len(x), batch_size)]
+            print("padding ratio: {:04.2f}% with contiguous batches, {:04.2f}% with length buckets".format(
+                padding_ratio(self.lengths, contiguous) * 100, padding_ratio(self.lengths, self.batch_indices) * 100))
         # in case of ELMo is used, indicate if the token dump exists and should be used
         #self.use_token_dump = use_token_dump
         #if self.embeddings.use_ELMo:     
@@ -55,26 +114,49 @@ class DataGenerator(keras.utils.Sequence):
             batch_x, batch_c, batch_l, batch_y = self.__data_generation(index)
             return [batch_x, batch_c, batch_l], batch_y
 
-    def shuffle_pair(self, a, b):
-        # generate permutation index array
-        permutation = np.random.permutation(a.shape[0])
-        # shuffle the two arrays
-        return a[permutation], b[permutation]
-
     def on_epoch_end(self):
-        # shuffle dataset at each epoch
-        if self.shuffle == True:
-            if self.y is None:
-                np.random.shuffle(self.x)
-            else:      
-                self.shuffle_pair(self.x,self.y)
+        # batches of the next epoch as indices of the samples, the data being never copied or reordered
+        random_state = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        if self.bucket_by_length:
+            # new batches of similar lengths, in a new random order if shuffle is set
+            self.batch_indices = get_length_buckets(self.lengths, self.batch_size, shuffle=self.shuffle, 
+                random_state=random_state)
+        elif self.shuffle == True:
+            permutation = random_state.permutation(len(self.x))
+            self.batch_indices = [permutation[start:start+self.batch_size] 
+                for start in range(0, len(self.x), self.batch_size)]
+
+    def get_batch_indices(self, index):
+        'Indices in the data of the sequences of a batch'
+        if self.batch_indices is not None:
+            return self.batch_indices[index]
+        start = index*self.batch_size
+        return np.arange(start, min(start+self.batch_size, len(self.x)))
+
+    def restore_order(self, batch_outputs):
+        """
+        Given the outputs of the batches of this generator, in the order of the batches, return the 
+        list of the outputs of each sequence in the order of the data
+        """
+        outputs = [None] * len(self.x)
+        for index, batch_output in enumerate(batch_outputs):
+            for i, output in zip(self.get_batch_indices(index), batch_output):
+                outputs[i] = output
+        return outputs
 
     def __data_generation(self, index):
         'Generates data containing batch_size samples' 
-        max_iter = min(self.batch_size, len(self.x)-self.batch_size*index)
+        indices = self.get_batch_indices(index)
+        max_iter = len(indices)
+        if self.materialized is not None:
+            return self.__materialized_data_generation(indices, max_iter)
 
         # restrict data to index window
-        sub_x = self.x[(index*self.batch_size):(index*self.batch_size)+max_iter]
+        if self.batch_indices is None:
+            sub_x = self.x[(index*self.batch_size):(index*self.batch_size)+max_iter]
+        else:
+            sub_x = [self.x[i] for i in indices]
 
         # tokenize texts in self.x if not already done
         max_length_x = 0
@@ -91,37 +173,40 @@ class DataGenerator(keras.utils.Sequence):
                     max_length_x = len(tokens)
             x_tokenized = sub_x
 
-        batch_x = np.zeros((max_iter, max_length_x, self.embeddings.embed_size), dtype='float32')
-        if self.preprocessor.return_casing:
-            batch_a = np.zeros((max_iter, max_length_x), dtype='float32')
-
-        batch_y = None
-        max_length_y = max_length_x
-        if self.y is not None:
-            # note: tags are always already "tokenized",
-            batch_y = np.zeros((max_iter, max_length_y), dtype='float32')
-
+        # word indices for the models with an embedding layer, word embeddings otherwise
+        use_word_index = self.preprocessor.vocab_word is not None and not self.embeddings.use_ELMo
         if self.embeddings.use_ELMo:     
             #batch_x = to_vector_elmo(x_tokenized, self.embeddings, max_length_x)
             batch_x = to_vector_simple_with_elmo(x_tokenized, self.embeddings, max_length_x)
-            
-        # generate data
-        for i in range(0, max_iter):
-            # store sample embeddings
-            if not self.embeddings.use_ELMo:    
-                batch_x[i] = to_vector_single(x_tokenized[i], self.embeddings, max_length_x)
+        elif use_word_index:
+            batch_x = self.__get_buffer('x', (max_iter, max_length_x), 'int32')
+            for i in range(0, max_iter):
+                batch_x[i, :len(x_tokenized[i])] = self.preprocessor.get_word_ids(x_tokenized[i])
+        else:
+            # the embeddings of the whole batch are retrieved with one single lookup
+            batch_x = to_vector_batch(x_tokenized, self.embeddings, max_length_x, 
+                out=self.__get_buffer('x', (max_iter, max_length_x, self.embeddings.embed_size)))
 
-            if self.preprocessor.return_casing:
-                batch_a[i] = to_casing_single(x_tokenized[i], max_length_x)
+        if self.preprocessor.return_casing:
+            batch_a = to_casing_batch(x_tokenized, max_length_x, 
+                out=self.__get_buffer('a', (max_iter, max_length_x)))
 
-            # store tag embeddings
-            if self.y is not None:
+        batch_y = None
+        if self.y is not None:
+            # note: tags are always already "tokenized",
+            if self.batch_indices is None:
                 batch_y = self.y[(index*self.batch_size):(index*self.batch_size)+max_iter]
+            else:
+                batch_y = [self.y[i] for i in indices]
 
+        batch_c = None
+        if self.preprocessor.use_char_feature and self.preprocessor.padding:
+            batch_c = self.__get_buffer('c', (max_iter, max_length_x, self.preprocessor.get_char_width(x_tokenized)), 'int32')
         if self.y is not None:
-            batches, batch_y = self.preprocessor.transform(x_tokenized, batch_y)
+            batches, batch_y = self.preprocessor.transform(x_tokenized, batch_y, char_ids=batch_c, 
+                sparse_labels=self.sparse_labels)
         else:
-            batches = self.preprocessor.transform(x_tokenized)
+            batches = self.preprocessor.transform(x_tokenized, char_ids=batch_c)
 
         batch_c = np.asarray(batches[0])
         batch_l = batches[1]
@@ -130,3 +215,210 @@ class DataGenerator(keras.utils.Sequence):
             return batch_x, batch_c, batch_a, batch_l, batch_y
         else: 
             return batch_x, batch_c, batch_l, batch_y
+
+    def __get_buffer(self, name, shape, dtype='float32'):
+        'Zero array for the current batch, reused across batches unless disabled'
+        if self.buffers is None:
+            return np.zeros(shape, dtype=dtype)
+        return self.buffers.get(name, shape, dtype)
+
+    def __materialized_data_generation(self, indices, max_iter):
+        'Generates data containing batch_size samples from the pre-vectorized data'
+        starts = self.materialized["offsets"][indices]
+        ends = self.materialized["offsets"][indices+1]
+        lengths = ends - starts
+        max_length_x = int(lengths.max())
+
+        words = self.materialized["words"]
+        chars = self.materialized["chars"]
+        if words.ndim == 1:
+            # word indices
+            batch_x = self.__get_buffer('x', (max_iter, max_length_x), 'int32')
+        else:
+            batch_x = self.__get_buffer('x', (max_iter, max_length_x, words.shape[1]))
+        batch_c = self.__get_buffer('c', (max_iter, max_length_x, chars.shape[1]), 'int32')
+        if self.preprocessor.return_casing:
+            batch_a = self.__get_buffer('a', (max_iter, max_length_x))
+        if self.y is not None:
+            batch_y = self.__get_buffer('y_ids', (max_iter, max_length_x), 'int32')
+        for i in range(0, max_iter):
+            length = lengths[i]
+            batch_x[i, :length] = words[starts[i]:ends[i]]
+            batch_c[i, :length] = chars[starts[i]:ends[i]]
+            if self.preprocessor.return_casing:
+                batch_a[i, :length] = self.materialized["casings"][starts[i]:ends[i]]
+            if self.y is not None:
+                batch_y[i, :length] = self.materialized["labels"][starts[i]:ends[i]]
+        batch_l = lengths.astype('int32').reshape((max_iter, 1))
+        if self.preprocessor.dynamic_char_length:
+            # the char ids are left aligned, so the width of the batch is its number of non empty columns
+            width = max(int(np.count_nonzero(batch_c.any(axis=(0, 1)))), 1)
+            batch_c = np.ascontiguousarray(batch_c[:, :, :width])
+
+        if self.y is not None and self.sparse_labels:
+            batch_y = batch_y.reshape((max_iter, max_length_x, 1))
+        elif self.y is not None:
+            # one-hot labels, the padding having the label 0 like in the preprocessor
+            batch_y_ids = batch_y
+            batch_y = self.__get_buffer('y', (max_iter, max_length_x, len(self.labels)), 'int32')
+            rows, columns = np.indices(batch_y_ids.shape)
+            batch_y[rows, columns, batch_y_ids] = 1
+        else:
+            batch_y = None
+
+        if self.preprocessor.return_casing:
+            return batch_x, batch_c, batch_a, batch_l, batch_y
+        else: 
+            return batch_x, batch_c, batch_l, batch_y
+
+
+# number of batches of sequences sorted together by length when the batches are shuffled
+bucket_pool_size = 50
+
+def get_length_buckets(lengths, batch_size, shuffle=True, random_state=np.random):
+    """
+    Group sequences of similar lengths into batches ("sortish" sampling), so that the batches are 
+    padded to fewer positions than contiguous slices of the data. Without shuffle, the sequences 
+    are simply sorted by length. With shuffle, the sequences are shuffled, sorted by length within 
+    pools of bucket_pool_size batches, and the resulting batches are given in a random order, so 
+    that the batches differ from one epoch to the next, random_state giving the permutations.
+
+    Returns:
+        list: arrays of the indices of the sequences of each batch
+    """
+    if not shuffle:
+        order = np.argsort(lengths, kind='mergesort')
+        return [order[start:start+batch_size] for start in range(0, len(order), batch_size)]
+
+    order = random_state.permutation(len(lengths))
+    pool_size = batch_size * bucket_pool_size
+    for start in range(0, len(order), pool_size):
+        pool = order[start:start+pool_size]
+        order[start:start+pool_size] = pool[np.argsort(lengths[pool], kind='mergesort')]
+    batches = [order[start:start+batch_size] for start in range(0, len(order), batch_size)]
+    return [batches[i] for i in random_state.permutation(len(batches))]
+
+def padding_ratio(lengths, batches):
+    """
+    Proportion of padding positions in the given batches, each batch being padded to the length of 
+    its longest sequence
+    """
+    nb_tokens = 0
+    nb_positions = 0
+    for batch in batches:
+        if len(batch) == 0:
+            continue
+        batch_lengths = lengths[batch]
+        nb_tokens += int(batch_lengths.sum())
+        nb_positions += int(batch_lengths.max()) * len(batch)
+    if nb_positions == 0:
+        return 0.0
+    return 1.0 - nb_tokens / nb_positions
+
+
+# version of the layout of the pre-vectorized data
+materialize_version = 1
+
+def _get_materialize_fingerprint(x, y, preprocessor, embeddings):
+    """
+    Fingerprint of a dataset with the embeddings and the preprocessor used to vectorize it
+    """
+    description = {
+        "version": materialize_version,
+        "embeddings": embeddings.name,
+        "embed_size": embeddings.embed_size,
+        "quantization": embeddings.quantization,
+        "store": embeddings.get_store_signature(),
+        "use_ELMo": embeddings.use_ELMo,
+        "vocab_char": sorted(preprocessor.vocab_char.items()),
+        "vocab_tag": sorted(preprocessor.vocab_tag.items()),
+        "max_char_length": preprocessor.max_char_length,
+        "nb_sequences": len(x)
+    }
+    use_word_index = preprocessor.vocab_word is not None and not embeddings.use_ELMo
+    if use_word_index:
+        description["vocab_word"] = list_digest(sorted(preprocessor.vocab_word, key=preprocessor.vocab_word.get))
+    if embeddings.use_ELMo:
+        description["ELMo"] = [embeddings.elmo_model_version, embeddings.elmo_cache_layers, 
+            embeddings.elmo_layer_weights.tolist(), embeddings.elmo_gamma, embeddings.elmo_layer_norm]
+    digest = hashlib.sha1(json.dumps(description, sort_keys=True).encode('UTF-8'))
+    for i in range(0, len(x)):
+        digest.update(list_digest(x[i]).encode('UTF-8'))
+        if y is not None:
+            digest.update(list_digest(y[i]).encode('UTF-8'))
+    return digest.hexdigest()
+
+def materialize_dataset(x, y, preprocessor, embeddings, path, batch_size=24):
+    """
+    Vectorize once a dataset of tokenized sequences (word embeddings or word indices, char ids, 
+    casing, tag ids) into memory-mapped arrays under the given directory, with one row per token 
+    and the token offsets of each sequence. The arrays are rebuilt if the dataset, the embeddings 
+    or the preprocessor have changed since they were written.
+
+    Returns:
+        dict: the memory-mapped arrays, by name
+    """
+    names = ["offsets", "words", "chars", "casings"]
+    if y is not None:
+        names.append("labels")
+    fingerprint = _get_materialize_fingerprint(x, y, preprocessor, embeddings)
+    meta_file = os.path.join(path, "meta.json")
+    if os.path.isfile(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint:
+            return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in names}
+        # stale data, written again below
+        os.remove(meta_file)
+
+    print("vectorizing", len(x), "sequences into", path)
+    os.makedirs(path, exist_ok=True)
+    offsets = np.zeros((len(x)+1,), dtype='int64')
+    offsets[1:] = np.cumsum([len(tokens) for tokens in x])
+    nb_tokens = int(offsets[-1])
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    arrays = {"offsets": offsets}
+    use_word_index = preprocessor.vocab_word is not None and not embeddings.use_ELMo
+    if use_word_index:
+        arrays["words"] = np.lib.format.open_memmap(os.path.join(path, "words.npy"), mode='w+', 
+            dtype='int32', shape=(nb_tokens,))
+    else:
+        arrays["words"] = np.lib.format.open_memmap(os.path.join(path, "words.npy"), mode='w+', 
+            dtype='float32', shape=(nb_tokens, embeddings.embed_size))
+    arrays["chars"] = np.lib.format.open_memmap(os.path.join(path, "chars.npy"), mode='w+', 
+        dtype='int32', shape=(nb_tokens, preprocessor.max_char_length))
+    arrays["casings"] = np.lib.format.open_memmap(os.path.join(path, "casings.npy"), mode='w+', 
+        dtype='float32', shape=(nb_tokens,))
+    if y is not None:
+        arrays["labels"] = np.lib.format.open_memmap(os.path.join(path, "labels.npy"), mode='w+', 
+            dtype='int32', shape=(nb_tokens,))
+
+    for start in range(0, len(x), batch_size):
+        sub_x = x[start:start+batch_size]
+        if embeddings.use_ELMo:
+            max_length_x = max(len(tokens) for tokens in sub_x)
+            batch_x = to_vector_simple_with_elmo(sub_x, embeddings, max_length_x)
+        for i, tokens in enumerate(sub_x):
+            begin = offsets[start+i]
+            end = offsets[start+i+1]
+            if end == begin:
+                continue
+            if use_word_index:
+                arrays["words"][begin:end] = preprocessor.get_word_ids(tokens)
+            elif embeddings.use_ELMo:
+                arrays["words"][begin:end] = batch_x[i][:len(tokens)]
+            else:
+                arrays["words"][begin:end] = to_vector_single(tokens, embeddings, len(tokens))
+            # stored with a width of max_char_length, even with a dynamic char width
+            chars = preprocessor.transform([tokens])[0][0]
+            arrays["chars"][begin:end, :chars.shape[1]] = chars
+            arrays["casings"][begin:end] = to_casing_single(tokens, len(tokens))
+            if y is not None:
+                arrays["labels"][begin:end] = [preprocessor.vocab_tag[tag] for tag in y[start+i]]
+
+    for name in names:
+        if name != "offsets":
+            arrays[name].flush()
+    with open(meta_file, 'w') as f:
+        json.dump({"fingerprint": fingerprint, "nb_sequences": len(x), "nb_tokens": nb_tokens}, f)
+    return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in names}
@@ -37,6 +37,122 @@ def get_model(config, preprocessor, ntags=None):
         raise (OSError('Model name does exist: ' + config.model_type))
 
 
+def _word_input(config):
+    """
+    Word input of the models and its embeddings: the word embeddings given by the data generator 
+    or, with config.use_word_index, the word indices looked up in a frozen embedding matrix 
+    (initialized by BaseModel.set_word_vectors())
+    """
+    if config.use_word_index:
+        word_input = Input(shape=(None,), dtype='int32', name='word_input')
+        word_embeddings = Embedding(input_dim=config.word_vocab_size,
+                                    output_dim=config.word_embedding_size,
+                                    trainable=False,
+                                    name='word_embeddings')(word_input)
+        return word_input, word_embeddings
+    word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+    return word_input, word_input
+
+
+def _char_input(config):
+    """
+    Char input of the models, of width max_char_length or, with config.dynamic_char_length, of the 
+    width of each batch (its longest word, capped at max_char_length)
+    """
+    char_length = None if config.dynamic_char_length else config.max_char_length
+    return Input(shape=(None, char_length), dtype='int32', name='char_input')
+
+
+def _flatten_words(char_input):
+    'Char ids of all the words of a batch as one batch of char sequences'
+    return Lambda(lambda x: K.reshape(x, (-1, K.shape(x)[2])), 
+                  output_shape=lambda input_shape: (None, input_shape[2]))(char_input)
+
+
+def _unflatten_words(word_vectors, char_input, size):
+    'Vectors of the words of a batch of flattened char sequences, back by sequence'
+    return Lambda(lambda x: K.reshape(x[0], (K.shape(x[1])[0], K.shape(x[1])[1], size)), 
+                  output_shape=lambda input_shapes: (input_shapes[1][0], input_shapes[1][1], size))([word_vectors, char_input])
+
+
+def _char_lstm(config):
+    """
+    Char input of the models and the representation of the words by a BiLSTM over their chars. 
+    With a dynamic char width, the words are flattened instead of using TimeDistributed, which 
+    requires a fixed width, and the padding chars are masked, so that the representation of a word 
+    does not depend on the width of its batch.
+    """
+    char_input = _char_input(config)
+    if not config.dynamic_char_length:
+        char_embeddings = TimeDistributed(Embedding(input_dim=config.char_vocab_size,
+                                    output_dim=config.char_embedding_size,
+                                    mask_zero=True,
+                                    #embeddings_initializer=RandomUniform(minval=-0.5, maxval=0.5),
+                                    name='char_embeddings'
+                                    ))(char_input)
+
+        chars = TimeDistributed(Bidirectional(LSTM(config.num_char_lstm_units, return_sequences=False)))(char_embeddings)
+        return char_input, chars
+
+    char_embeddings = Embedding(input_dim=config.char_vocab_size,
+                                output_dim=config.char_embedding_size,
+                                mask_zero=True,
+                                name='char_embeddings'
+                                )(_flatten_words(char_input))
+    chars = Bidirectional(LSTM(config.num_char_lstm_units, return_sequences=False))(char_embeddings)
+    return char_input, _unflatten_words(chars, char_input, 2 * config.num_char_lstm_units)
+
+
+def _char_cnn(config):
+    """
+    Char input of the models and the representation of the words by a CNN over their chars, max 
+    pooled. With a dynamic char width, the words are flattened instead of using TimeDistributed.
+    """
+    char_input = _char_input(config)
+    if not config.dynamic_char_length:
+        char_embeddings = TimeDistributed(
+                                Embedding(input_dim=config.char_vocab_size,
+                                    output_dim=config.char_embedding_size,
+                                    mask_zero=True,
+                                    name='char_embeddings'
+                                    ))(char_input)
+
+        dropout = Dropout(config.dropout)(char_embeddings)
+        
+        conv1d_out = TimeDistributed(Conv1D(kernel_size=3, filters=30, padding='same',activation='tanh', strides=1))(dropout)
+        maxpool_out = TimeDistributed(GlobalMaxPooling1D())(conv1d_out)
+        return char_input, maxpool_out
+
+    # the convolution does not support Keras masks, so the padding chars are masked explicitly: 
+    # their embeddings are zeroed like the 'same' padding of the convolution and they are excluded 
+    # from the max pooling, so that a word does not depend on the width of its batch
+    char_ids = _flatten_words(char_input)
+    char_mask = Lambda(lambda x: K.expand_dims(K.cast(K.not_equal(x, 0), K.floatx()), -1), 
+                       output_shape=lambda input_shape: input_shape + (1,))(char_ids)
+    char_embeddings = Embedding(input_dim=config.char_vocab_size,
+                                output_dim=config.char_embedding_size,
+                                name='char_embeddings'
+                                )(char_ids)
+
+    dropout = Dropout(config.dropout)(char_embeddings)
+    dropout = Lambda(lambda x: x[0] * x[1], output_shape=lambda input_shapes: input_shapes[0])([dropout, char_mask])
+
+    conv1d_out = Conv1D(kernel_size=3, filters=30, padding='same',activation='tanh', strides=1)(dropout)
+    maxpool_out = Lambda(_masked_max_pooling, 
+                         output_shape=lambda input_shapes: (input_shapes[0][0], input_shapes[0][2]))([conv1d_out, char_mask])
+    return char_input, _unflatten_words(maxpool_out, char_input, 30)
+
+
+def _masked_max_pooling(inputs):
+    """
+    Max over the chars of the features of a batch of char sequences, ignoring the padding chars, 
+    the features of the words without char (padding words) being zero
+    """
+    features, mask = inputs
+    pooled = K.max(features + (mask - 1.) * 1e9, axis=1)
+    return pooled * K.max(mask, axis=1)
+
+
 class BaseModel(object):
 
     def __init__(self, config, ntags):
@@ -59,6 +175,9 @@ class BaseModel(object):
         print('loading model weights', filepath)
         self.model.load_weights(filepath=filepath)
 
+    def set_word_vectors(self, word_vectors):
+        self.model.get_layer('word_embeddings').set_weights([word_vectors])
+
     def __getattr__(self, name):
         return getattr(self.model, name)
 
@@ -81,25 +200,17 @@ class BidLSTM_CRF(BaseModel):
 
     def __init__(self, config, ntags=None):
 
-        # build input, directly feed with word embedding by the data generator
-        word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+        # build input, directly feed with word embedding or word indices by the data generator
+        word_input, word_embeddings = _word_input(config)
 
         # build character based embedding
-        char_input = Input(shape=(None, config.max_char_length), dtype='int32', name='char_input')
-        char_embeddings = TimeDistributed(Embedding(input_dim=config.char_vocab_size,
-                                    output_dim=config.char_embedding_size,
-                                    mask_zero=True,
-                                    #embeddings_initializer=RandomUniform(minval=-0.5, maxval=0.5),
-                                    name='char_embeddings'
-                                    ))(char_input)
-
-        chars = TimeDistributed(Bidirectional(LSTM(config.num_char_lstm_units, return_sequences=False)))(char_embeddings)
+        char_input, chars = _char_lstm(config)
 
         # length of sequence not used for the moment (but used for f1 communication)
         length_input = Input(batch_shape=(None, 1), dtype='int32', name='length_input')
 
         # combine characters and word embeddings
-        x = Concatenate()([word_input, chars])
+        x = Concatenate()([word_embeddings, chars])
         x = Dropout(config.dropout)(x)
 
         x = Bidirectional(LSTM(units=config.num_word_lstm_units, 
@@ -127,22 +238,11 @@ class BidLSTM_CNN(BaseModel):
 
     def __init__(self, config, ntags=None):
         
-        # build input, directly feed with word embedding by the data generator
-        word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+        # build input, directly feed with word embedding or word indices by the data generator
+        word_input, word_embeddings = _word_input(config)
 
         # build character based embedding        
-        char_input = Input(shape=(None, config.max_char_length), dtype='int32', name='char_input')
-        char_embeddings = TimeDistributed(
-                                Embedding(input_dim=config.char_vocab_size,
-                                    output_dim=config.char_embedding_size,
-                                    mask_zero=True,
-                                    name='char_embeddings'
-                                    ))(char_input)
-
-        dropout = Dropout(config.dropout)(char_embeddings)
-        
-        conv1d_out = TimeDistributed(Conv1D(kernel_size=3, filters=30, padding='same',activation='tanh', strides=1))(dropout)
-        maxpool_out = TimeDistributed(GlobalMaxPooling1D())(conv1d_out)
+        char_input, maxpool_out = _char_cnn(config)
         chars = Dropout(config.dropout)(maxpool_out)
 
         # custom features input and embeddings
@@ -158,7 +258,7 @@ class BidLSTM_CNN(BaseModel):
         length_input = Input(batch_shape=(None, 1), dtype='int32')
 
         # combine words, custom features and characters
-        x = Concatenate(axis=-1)([word_input, casing_embedding, chars])
+        x = Concatenate(axis=-1)([word_embeddings, casing_embedding, chars])
         x = Dropout(config.dropout)(x)
         x = Bidirectional(LSTM(units=config.num_word_lstm_units, 
                                return_sequences=True, 
@@ -182,22 +282,11 @@ class BidLSTM_CNN_CRF(BaseModel):
 
     def __init__(self, config, ntags=None):
         
-        # build input, directly feed with word embedding by the data generator
-        word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+        # build input, directly feed with word embedding or word indices by the data generator
+        word_input, word_embeddings = _word_input(config)
 
         # build character based embedding        
-        char_input = Input(shape=(None, config.max_char_length), dtype='int32', name='char_input')
-        char_embeddings = TimeDistributed(
-                                Embedding(input_dim=config.char_vocab_size,
-                                    output_dim=config.char_embedding_size,
-                                    mask_zero=True,
-                                    name='char_embeddings'
-                                    ))(char_input)
-
-        dropout = Dropout(config.dropout)(char_embeddings)
-        
-        conv1d_out = TimeDistributed(Conv1D(kernel_size=3, filters=30, padding='same',activation='tanh', strides=1))(dropout)
-        maxpool_out = TimeDistributed(GlobalMaxPooling1D())(conv1d_out)
+        char_input, maxpool_out = _char_cnn(config)
         chars = Dropout(config.dropout)(maxpool_out)
 
         # custom features input and embeddings
@@ -214,7 +303,7 @@ class BidLSTM_CNN_CRF(BaseModel):
         length_input = Input(batch_shape=(None, 1), dtype='int32')
 
         # combine words, custom features and characters
-        x = Concatenate(axis=-1)([word_input, casing_embedding, chars])
+        x = Concatenate(axis=-1)([word_embeddings, casing_embedding, chars])
         x = Dropout(config.dropout)(x)
 
         x = Bidirectional(LSTM(units=config.num_word_lstm_units, 
@@ -236,25 +325,17 @@ class BidGRU_CRF(BaseModel):
     """
     def __init__(self, config, ntags=None):
 
-        # build input, directly feed with word embedding by the data generator
-        word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+        # build input, directly feed with word embedding or word indices by the data generator
+        word_input, word_embeddings = _word_input(config)
 
         # build character based embedding
-        char_input = Input(shape=(None, config.max_char_length), dtype='int32', name='char_input')
-        char_embeddings = TimeDistributed(Embedding(input_dim=config.char_vocab_size,
-                                    output_dim=config.char_embedding_size,
-                                    mask_zero=True,
-                                    #embeddings_initializer=RandomUniform(minval=-0.5, maxval=0.5),
-                                    name='char_embeddings'
-                                    ))(char_input)
-
-        chars = TimeDistributed(Bidirectional(LSTM(config.num_char_lstm_units, return_sequences=False)))(char_embeddings)
+        char_input, chars = _char_lstm(config)
 
         # length of sequence not used for the moment (but used for f1 communication)
         length_input = Input(batch_shape=(None, 1), dtype='int32', name='length_input')
 
         # combine characters and word embeddings
-        x = Concatenate()([word_input, chars])
+        x = Concatenate()([word_embeddings, chars])
         x = Dropout(config.dropout)(x)
 
         x = Bidirectional(GRU(units=config.num_word_lstm_units, 
@@ -286,19 +367,11 @@ class BidLSTM_CRF_CASING(BaseModel):
 
     def __init__(self, config, ntags=None):
 
-        # build input, directly feed with word embedding by the data generator
-        word_input = Input(shape=(None, config.word_embedding_size), name='word_input')
+        # build input, directly feed with word embedding or word indices by the data generator
+        word_input, word_embeddings = _word_input(config)
 
         # build character based embedding
-        char_input = Input(shape=(None, config.max_char_length), dtype='int32', name='char_input')
-        char_embeddings = TimeDistributed(Embedding(input_dim=config.char_vocab_size,
-                                    output_dim=config.char_embedding_size,
-                                    mask_zero=True,
-                                    #embeddings_initializer=RandomUniform(minval=-0.5, maxval=0.5),
-                                    name='char_embeddings'
-                                    ))(char_input)
-
-        chars = TimeDistributed(Bidirectional(LSTM(config.num_char_lstm_units, return_sequences=False)))(char_embeddings)
+        char_input, chars = _char_lstm(config)
 
         # custom features input and embeddings
         casing_input = Input(batch_shape=(None, None,), dtype='int32', name='casing_input')
@@ -314,7 +387,7 @@ class BidLSTM_CRF_CASING(BaseModel):
         length_input = Input(batch_shape=(None, 1), dtype='int32', name='length_input')
 
         # combine characters and word embeddings
-        x = Concatenate()([word_input, casing_embedding, chars])
+        x = Concatenate()([word_embeddings, casing_embedding, chars])
         x = Dropout(config.dropout)(x)
 
         x = Bidirectional(LSTM(units=config.num_word_lstm_units, 
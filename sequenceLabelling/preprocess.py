@@ -1,5 +1,6 @@
 import itertools
 import re
+from functools import lru_cache
 import numpy as np
 np.random.seed(7)
 #from tensorflow import set_random_seed
@@ -16,15 +17,35 @@ PAD = '<PAD>'
 
 case_index = {'<PAD>': 0, 'numeric': 1, 'allLower':2, 'allUpper':3, 'initialUpper':4, 'other':5, 'mainly_numeric':6, 'contains_digit': 7}
 
+# maximum number of word types for which the normalized form, the casing and the char ids are 
+# memoized, the same frequent tokens being preprocessed at each batch of each epoch
+word_cache_size = 100000
+
+_num_regex = re.compile(r'[0-9０１２３４５６７８９]')
+
 class WordPreprocessor(BaseEstimator, TransformerMixin):
 
+    # word -> index of the word embeddings, for the models taking word indices as input (also 
+    # defined at class level for the preprocessors saved before)
+    vocab_word = None
+
+    # if True, the char sequences are padded to the longest word of each batch, capped at 
+    # max_char_length (also defined at class level for the preprocessors saved before)
+    dynamic_char_length = False
+
+    # memoized char ids of the words, as word -> row of a table of char ids padded to max_char_length 
+    # (row 0 being the padding), not saved with the preprocessor
+    _char_ids_cache = None
+    _char_ids_table = None
+
     def __init__(self,
                  use_char_feature=True,
                  padding=True,
                  return_lengths=True, 
                  return_casing=False, 
                  return_features=False, 
-                 max_char_length=30
+                 max_char_length=30, 
+                 dynamic_char_length=False
                  ):
 
         self.use_char_feature = use_char_feature
@@ -36,8 +57,11 @@ class WordPreprocessor(BaseEstimator, TransformerMixin):
         self.vocab_tag  = None
         self.vocab_case = [k for k, v in case_index.items()]
         self.max_char_length = max_char_length
+        self.dynamic_char_length = dynamic_char_length
 
     def fit(self, X, y):
+        self._char_ids_cache = None
+        self._char_ids_table = None
         chars = {PAD: 0, UNK: 1}
         tags  = {PAD: 0}
 
@@ -57,36 +81,35 @@ class WordPreprocessor(BaseEstimator, TransformerMixin):
 
         return self
 
-    def transform(self, X, y=None):
+    def transform(self, X, y=None, char_ids=None, sparse_labels=False):
         """
         transforms input into sequence
 
         Args:
             X: list of list of word tokens
             y: list of list of tags
+            char_ids: optional zero int array of shape (nb sequences, max sequence length, 
+                char width), filled with the padded char sequences instead of a new array
+            sparse_labels: if True, the tags are given as ids of shape (nb sequences, max sequence 
+                length, 1) instead of one-hot vectors, for the sparse losses
 
         Returns:
             numpy array: sentences with char sequences, and optionally length, casing and custom features  
             numpy array: sequence of tags
         """
-        chars = []
-        lengths = []
-        for sent in X:
-            char_ids = []
-            lengths.append(len(sent))
-            for w in sent:
-                if self.use_char_feature:
-                    char_ids.append(self.get_char_ids(w))
-
-            if self.use_char_feature:
-                chars.append(char_ids)
+        lengths = [len(sent) for sent in X]
 
         if y is not None:
             y = [[self.vocab_tag[t] for t in sent] for sent in y]
 
-        if self.padding:
-            sents, y = self.pad_sequence(chars, y)
+        if self.use_char_feature and self.padding:
+            sents = [self.get_char_id_array(X, max(lengths), out=char_ids)]
+            if y:
+                y = self.pad_labels(y, sparse=sparse_labels)
+        elif self.padding:
+            sents, y = self.pad_sequence([], y)
         else:
+            chars = [[self.get_char_ids(w) for w in sent] for sent in X] if self.use_char_feature else []
             sents = [chars]
 
         # optional additional information
@@ -98,6 +121,34 @@ class WordPreprocessor(BaseEstimator, TransformerMixin):
 
         return (sents, y) if y is not None else sents
 
+    def fit_word_vectors(self, X, embeddings, top_n=0):
+        """
+        Build the vocabulary of the word indices from the tokens of X and the top_n most frequent 
+        words of the embeddings, keeping only the words with an embedding
+
+        Returns:
+            numpy array: the embeddings of the vocabulary, with zero vectors for <PAD> and <UNK> 
+        """
+        words = {}
+        for word in embeddings.get_top_words(top_n):
+            words[word] = None
+        for word in itertools.chain(*X):
+            # the numbers are normalized before the embeddings lookup
+            words[_normalize_num(word)] = None
+        words = [word for word in words if word != PAD and word != UNK]
+        vectors = embeddings.get_word_vectors(words)
+        known = np.any(vectors != 0, axis=1)
+
+        self.vocab_word = {PAD: 0, UNK: 1}
+        for word in itertools.compress(words, known):
+            self.vocab_word[word] = len(self.vocab_word)
+        word_vectors = np.zeros((len(self.vocab_word), vectors.shape[1]), dtype=np.float32)
+        word_vectors[2:] = vectors[known]
+        return word_vectors
+
+    def get_word_ids(self, words):
+        return [self.vocab_word.get(_normalize_num(w), self.vocab_word[UNK]) for w in words]
+
     def inverse_transform(self, y):
         """
         send back original label string
@@ -108,11 +159,66 @@ class WordPreprocessor(BaseEstimator, TransformerMixin):
     def get_char_ids(self, word):
         return [self.vocab_char.get(c, self.vocab_char[UNK]) for c in word]
 
+    def get_char_width(self, X):
+        """
+        Number of chars to which the words of a batch of sequences are truncated or padded: 
+        max_char_length, or the length of the longest word of the batch with dynamic_char_length
+        """
+        if not self.dynamic_char_length:
+            return self.max_char_length
+        width = 1
+        for sent in X:
+            if len(sent) > 0:
+                width = max(width, max(len(w) for w in sent))
+        return min(width, self.max_char_length)
+
+    def get_char_id_array(self, X, max_length, out=None):
+        """
+        Char ids of a batch of sequences of words as an int32 array of shape (nb sequences, 
+        max_length, char width), the words being truncated or padded to the char width given by 
+        get_char_width(), gathered from the memoized rows of char ids of the words. The array is 
+        written in out if given.
+        """
+        nb_words = sum(len(sent) for sent in X)
+        if self._char_ids_cache is None or len(self._char_ids_cache) + nb_words > word_cache_size:
+            # the rows of a batch must stay valid until it is gathered, so the cache is emptied 
+            # before and not during the batch
+            self._char_ids_cache = {}
+            self._char_ids_table = np.zeros((1024, self.max_char_length), dtype=np.int32)
+        rows = np.zeros((len(X), max_length), dtype=np.int64)
+        for i, sent in enumerate(X):
+            rows[i, :len(sent)] = [self._get_char_id_row(w) for w in sent]
+        table = self._char_ids_table
+        if self.dynamic_char_length:
+            width = out.shape[2] if out is not None else self.get_char_width(X)
+            table = table[:, :width]
+        return np.take(table, rows, axis=0, out=out, mode='clip')
+
+    def _get_char_id_row(self, word):
+        row = self._char_ids_cache.get(word)
+        if row is None:
+            # row 0 is the padding
+            row = len(self._char_ids_cache) + 1
+            if row == self._char_ids_table.shape[0]:
+                table = np.zeros((2 * row, self.max_char_length), dtype=np.int32)
+                table[:row] = self._char_ids_table
+                self._char_ids_table = table
+            char_ids = self.get_char_ids(word[:self.max_char_length])
+            self._char_ids_table[row, :len(char_ids)] = char_ids
+            self._char_ids_cache[word] = row
+        return row
+
+    def pad_labels(self, labels, sparse=False):
+        label_ids = np.zeros((len(labels), max(len(sent) for sent in labels)), dtype=np.int32)
+        for i, sent in enumerate(labels):
+            label_ids[i, :len(sent)] = sent
+        if sparse:
+            return label_ids.reshape(label_ids.shape + (1,))
+        return dense_to_one_hot(label_ids, len(self.vocab_tag), nlevels=2)
+
     def pad_sequence(self, char_ids, labels=None):
         if labels:
-            labels, _ = pad_sequences(labels, 0)
-            labels = np.asarray(labels)
-            labels = dense_to_one_hot(labels, len(self.vocab_tag), nlevels=2)
+            labels = self.pad_labels(labels)
 
         if self.use_char_feature:
             char_ids, word_lengths = pad_sequences(char_ids, pad_tok=0, nlevels=2, max_char_length=self.max_char_length)
@@ -121,6 +227,12 @@ class WordPreprocessor(BaseEstimator, TransformerMixin):
         else:
             return labels
 
+    def __getstate__(self):
+        state = super(WordPreprocessor, self).__getstate__().copy()
+        state.pop('_char_ids_cache', None)
+        state.pop('_char_ids_table', None)
+        return state
+
     def save(self, file_path):
         joblib.dump(self, file_path)
 
@@ -206,7 +318,8 @@ def dense_to_one_hot(labels_dense, num_classes, nlevels=1):
 
 
 def prepare_preprocessor(X, y, model_config):
-    p = WordPreprocessor(max_char_length=model_config.max_char_length)
+    p = WordPreprocessor(max_char_length=model_config.max_char_length, 
+                         dynamic_char_length=model_config.dynamic_char_length)
     p.fit(X, y)
 
     return p
@@ -220,19 +333,41 @@ def to_vector_single(tokens, embeddings, maxlen=300, lowercase=False, num_norm=T
     window = tokens[-maxlen:]
     
     # TBD: use better initializers (uniform, etc.) 
-    x = np.zeros((maxlen, embeddings.embed_size), )
+    x = np.zeros((maxlen, embeddings.embed_size), dtype=np.float32)
 
     # TBD: padding should be left and which vector do we use for padding? 
     # and what about masking padding later for RNN?
-    for i, word in enumerate(window):
+    words = []
+    for word in window:
         if lowercase:
             word = _lower(word)
         if num_norm:
             word = _normalize_num(word)
-        x[i,:] = embeddings.get_word_vector(word).astype('float32')
+        words.append(word)
+    if len(words) > 0:
+        # all the vectors of the sequence are retrieved with one single batch lookup
+        x[:len(words)] = embeddings.get_word_vectors(words)
 
     return x
 
+def to_vector_batch(tokens, embeddings, maxlen=300, lowercase=False, num_norm=True, out=None):
+    """
+    Given a batch of lists of tokens convert it to sequences of word embedding vectors with the 
+    provided embeddings, like to_vector_single() but with one single lookup for the batch, 
+    written in out if given (zero array of shape (nb sequences, maxlen, embeddings size))
+    """
+    windows = []
+    for sentence in tokens:
+        words = []
+        for word in sentence[-maxlen:]:
+            if lowercase:
+                word = _lower(word)
+            if num_norm:
+                word = _normalize_num(word)
+            words.append(word)
+        windows.append(words)
+    return embeddings.get_word_vectors(windows, maxlen, out=out)
+
 def to_vector_elmo(tokens, embeddings, maxlen=300, lowercase=False, num_norm=True):
     """
     Given a list of tokens convert it to a sequence of word embedding 
@@ -293,6 +428,20 @@ def to_casing_single(tokens, maxlen=300):
 
     return x    
 
+def to_casing_batch(tokens, maxlen=300, out=None):
+    """
+    Given a batch of lists of tokens set the casing, like to_casing_single(), written in out if 
+    given (zero array of shape (nb sequences, maxlen))
+    """
+    x = out
+    if x is None:
+        x = np.zeros((len(tokens), maxlen), dtype=np.float32)
+    for i, sentence in enumerate(tokens):
+        window = sentence[-maxlen:]
+        x[i, :len(window)] = [_casing(word) for word in window]
+    return x
+
+@lru_cache(maxsize=word_cache_size)
 def _casing(word):   
         casing = 'other'
         
@@ -320,7 +469,8 @@ def _casing(word):
 def _lower(word):
     return word.lower() 
 
+@lru_cache(maxsize=word_cache_size)
 def _normalize_num(word):
-    return re.sub(r'[0-9０１２３４５６７８９]', r'0', word)
+    return _num_regex.sub(r'0', word)
 
 
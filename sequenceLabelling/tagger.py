@@ -10,11 +10,13 @@ class Tagger(object):
                 model, 
                 model_config, 
                 embeddings=None, 
-                preprocessor=None):
+                preprocessor=None, 
+                bucket_by_length=False):
         self.model = model
         self.preprocessor = preprocessor
         self.model_config = model_config
         self.embeddings = embeddings
+        self.bucket_by_length = bucket_by_length
 
     def tag(self, texts, output_format):
         assert isinstance(texts, list)
@@ -33,16 +35,28 @@ class Tagger(object):
             batch_size=self.model_config.batch_size, 
             preprocessor=self.preprocessor, 
             char_embed_size=self.model_config.char_embedding_size,
-            embeddings=self.embeddings, tokenize=True, shuffle=False)
-
-        nb_workers = 6
-        if self.embeddings.use_ELMo:
-            nb_workers = 0
-        preds = self.model.predict_generator(
-            generator=predict_generator,
-            use_multiprocessing=True,
-            workers=nb_workers
-            )
+            embeddings=self.embeddings, tokenize=True, shuffle=False, 
+            bucket_by_length=self.bucket_by_length, 
+            # the bucketed batches are predicted one by one below, so the batch buffers can be reused
+            reuse_buffers=self.bucket_by_length)
+
+        if self.bucket_by_length:
+            # the batches have different lengths and follow the order of the text lengths, so they 
+            # are predicted one by one and the predictions put back in the order of the texts
+            batch_preds = []
+            for i in range(0, len(predict_generator)):
+                data, _ = predict_generator[i]
+                batch_preds.append(self.model.predict_on_batch(data))
+            preds = predict_generator.restore_order(batch_preds)
+        else:
+            nb_workers = 6
+            if self.embeddings.use_ELMo:
+                nb_workers = 0
+            preds = self.model.predict_generator(
+                generator=predict_generator,
+                use_multiprocessing=True,
+                workers=nb_workers
+                )
         
         for i in range(0,len(preds)):
             pred = [preds[i]]
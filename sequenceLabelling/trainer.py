@@ -47,11 +47,7 @@ class Trainer(object):
         self.model.summary()
         #print("self.model_config.use_crf:", self.model_config.use_crf)
         
-        if self.model_config.use_crf:
-            self.model.compile(loss=self.model.crf.loss,
-                           optimizer='nadam')
-        else:
-            self.model.compile(loss='categorical_crossentropy',
+        self.model.compile(loss=self.get_loss(self.model),
                            optimizer='nadam')
                            #optimizer=Adam(lr=self.training_config.learning_rate))
         # uncomment to plot graph
@@ -61,21 +57,45 @@ class Trainer(object):
                                                   self.training_config.max_epoch)
         
 
+    """ loss of the model, for tag ids with sparse labels and for one-hot tags otherwise """
+    def get_loss(self, model):
+        if self.model_config.use_crf:
+            if self.training_config.sparse_labels:
+                return model.crf.sparse_loss
+            return model.crf.loss
+        if self.training_config.sparse_labels:
+            return 'sparse_categorical_crossentropy'
+        return 'categorical_crossentropy'
+
     """ parameter model local_model must be compiled before calling this method 
         this model will be returned with trained weights """
-    def train_model(self, local_model, x_train, y_train, x_valid=None, y_valid=None, max_epoch=50):
+    def train_model(self, local_model, x_train, y_train, x_valid=None, y_valid=None, max_epoch=50, fold_id=None):
         # todo: if valid set if None, create it as random segment of the shuffled train set 
 
+        # optional pre-vectorized training and validation data, rebuilt only if they change
+        train_path = None
+        valid_path = None
+        if self.training_config.materialize_path is not None:
+            # one directory per fold, the folds having different training and validation data
+            data_name = self.model_config.model_name
+            if fold_id is not None:
+                data_name += '-fold' + str(fold_id)
+            train_path = os.path.join(self.training_config.materialize_path, data_name + '-train')
+            valid_path = os.path.join(self.training_config.materialize_path, data_name + '-valid')
+
         if self.training_config.early_stop:
             training_generator = DataGenerator(x_train, y_train, 
                 batch_size=self.training_config.batch_size, preprocessor=self.preprocessor, 
                 char_embed_size=self.model_config.char_embedding_size, 
-                embeddings=self.embeddings, shuffle=True)
+                embeddings=self.embeddings, shuffle=True, materialize_path=train_path, 
+                bucket_by_length=self.training_config.bucket_by_length, 
+                sparse_labels=self.training_config.sparse_labels)
 
             validation_generator = DataGenerator(x_valid, y_valid,  
                 batch_size=self.training_config.batch_size, preprocessor=self.preprocessor, 
                 char_embed_size=self.model_config.char_embedding_size, 
-                embeddings=self.embeddings, shuffle=False)
+                embeddings=self.embeddings, shuffle=False, materialize_path=valid_path, 
+                bucket_by_length=self.training_config.bucket_by_length)
 
             callbacks = get_callbacks(log_dir=self.checkpoint_path,
                                       eary_stopping=True,
@@ -86,12 +106,14 @@ class Trainer(object):
             training_generator = DataGenerator(x_train, y_train, 
                 batch_size=self.training_config.batch_size, preprocessor=self.preprocessor, 
                 char_embed_size=self.model_config.char_embedding_size, 
-                embeddings=self.embeddings, shuffle=True)
+                embeddings=self.embeddings, shuffle=True, materialize_path=train_path, 
+                bucket_by_length=self.training_config.bucket_by_length, 
+                sparse_labels=self.training_config.sparse_labels)
 
             callbacks = get_callbacks(log_dir=self.checkpoint_path,
                                       eary_stopping=False)
         nb_workers = 6
-        if self.embeddings.use_ELMo:
+        if self.embeddings.use_ELMo and self.training_config.materialize_path is None:
             nb_workers = 0
             # dump token context independent data for train set, done once for the training
 
@@ -136,11 +158,7 @@ class Trainer(object):
 
             foldModel = self.models[fold_id]
             foldModel.summary()
-            if self.model_config.use_crf:
-                foldModel.compile(loss=foldModel.crf.loss,
-                               optimizer='adam')
-            else:
-                foldModel.compile(loss='categorical_crossentropy',
+            foldModel.compile(loss=self.get_loss(foldModel),
                                optimizer='adam')
 
             foldModel = self.train_model(foldModel, 
@@ -148,7 +166,8 @@ class Trainer(object):
                                     train_y, 
                                     val_x, 
                                     val_y,
-                                    max_epoch=self.training_config.max_epoch)
+                                    max_epoch=self.training_config.max_epoch, 
+                                    fold_id=fold_id)
             self.models[fold_id] = foldModel
 
 
@@ -17,13 +17,13 @@ import keras.backend as K
 
 from sequenceLabelling.config import ModelConfig, TrainingConfig
 from sequenceLabelling.models import get_model
-from sequenceLabelling.preprocess import prepare_preprocessor, WordPreprocessor
+from sequenceLabelling.preprocess import prepare_preprocessor, WordPreprocessor, _normalize_num
 from sequenceLabelling.tagger import Tagger
 from sequenceLabelling.trainer import Trainer
 from sequenceLabelling.data_generator import DataGenerator
 from sequenceLabelling.trainer import Scorer
 
-from utilities.Embeddings import Embeddings
+from utilities.Embeddings import Embeddings, subset_vocab_file
 
 # initially derived from https://github.com/Hironsan/anago/blob/master/anago/wrapper.py
 # with various modifications
@@ -57,7 +57,13 @@ class Sequence(object):
                  max_checkpoints_to_keep=5, 
                  log_dir=None,
                  use_ELMo=True,
-                 fold_number=1):
+                 fold_number=1, 
+                 materialize_path=None, 
+                 use_word_index=False, 
+                 word_index_top_n=0, 
+                 bucket_by_length=False, 
+                 sparse_labels=False, 
+                 dynamic_char_length=False):
 
         self.model = None
         self.models = None
@@ -70,6 +76,10 @@ class Sequence(object):
             self.embeddings = Embeddings(embeddings_name, use_ELMo=use_ELMo) 
             word_emb_size = self.embeddings.embed_size
 
+        if use_word_index and use_ELMo:
+            print("Warning: ELMo embeddings are contextual and cannot be looked up by word index, the word embeddings are given to the model")
+            use_word_index = False
+
         self.model_config = ModelConfig(model_name=model_name, 
                                         model_type=model_type, 
                                         embeddings_name=embeddings_name, 
@@ -84,12 +94,16 @@ class Sequence(object):
                                         use_crf=use_crf, 
                                         fold_number=fold_number, 
                                         batch_size=batch_size,
-                                        use_ELMo=use_ELMo)
+                                        use_ELMo=use_ELMo, 
+                                        use_word_index=use_word_index, 
+                                        word_index_top_n=word_index_top_n, 
+                                        dynamic_char_length=dynamic_char_length)
 
         self.training_config = TrainingConfig(batch_size, optimizer, learning_rate,
                                               lr_decay, clip_gradients, max_epoch,
                                               early_stop, patience, 
-                                              max_checkpoints_to_keep)
+                                              max_checkpoints_to_keep, materialize_path, 
+                                              bucket_by_length, sparse_labels)
 
 
     def train(self, x_train, y_train, x_valid=None, y_valid=None):
@@ -99,6 +113,7 @@ class Sequence(object):
         self.p = prepare_preprocessor(x_all, y_all, self.model_config)
         self.model_config.char_vocab_size = len(self.p.vocab_char)
         self.model_config.case_vocab_size = len(self.p.vocab_case)
+        word_vectors = self._prepare_word_vectors(x_all)
 
         """
         if self.embeddings.use_ELMo:
@@ -111,6 +126,8 @@ class Sequence(object):
             self.embeddings.dump_ELMo_token_embeddings(x_train_local)
         """
         self.model = get_model(self.model_config, self.p, len(self.p.vocab_tag))
+        if word_vectors is not None:
+            self.model.set_word_vectors(word_vectors)
         trainer = Trainer(self.model, 
                           self.models,
                           self.embeddings,
@@ -120,16 +137,16 @@ class Sequence(object):
                           preprocessor=self.p
                           )
         trainer.train(x_train, y_train, x_valid, y_valid)
-        if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
 
     def train_nfold(self, x_train, y_train, x_valid=None, y_valid=None, fold_number=10):
         if x_valid is not None and y_valid is not None:
             x_all = np.concatenate((x_train, x_valid), axis=0)
             y_all = np.concatenate((y_train, y_valid), axis=0)
             self.p = prepare_preprocessor(x_all, y_all, self.model_config)
+            word_vectors = self._prepare_word_vectors(x_all)
         else:
             self.p = prepare_preprocessor(x_train, y_train, self.model_config)
+            word_vectors = self._prepare_word_vectors(x_train)
         self.model_config.char_vocab_size = len(self.p.vocab_char)
         self.model_config.case_vocab_size = len(self.p.vocab_case)
         self.p.return_lengths = True
@@ -139,6 +156,8 @@ class Sequence(object):
 
         for k in range(0, fold_number):
             model = get_model(self.model_config, self.p, len(self.p.vocab_tag))
+            if word_vectors is not None:
+                model.set_word_vectors(word_vectors)
             self.models.append(model)
 
         trainer = Trainer(self.model, 
@@ -150,8 +169,18 @@ class Sequence(object):
                           preprocessor=self.p
                           )
         trainer.train_nfold(x_train, y_train, x_valid, y_valid)
-        if self.embeddings.use_ELMo:
-            self.embeddings.clean_ELMo_cache()
+
+    def _prepare_word_vectors(self, x):
+        """
+        For the models taking word indices as input, build the word vocabulary of the 
+        preprocessor and return the embeddings of this vocabulary, None otherwise
+        """
+        if not self.model_config.use_word_index:
+            return None
+        word_vectors = self.p.fit_word_vectors(x, self.embeddings, top_n=self.model_config.word_index_top_n)
+        self.model_config.word_vocab_size = len(word_vectors)
+        print("word index of", len(word_vectors), "words")
+        return word_vectors
 
     def eval(self, x_test, y_test):
         if self.model_config.fold_number > 1 and self.models and len(self.models) == self.model_config.fold_number:
@@ -166,7 +195,8 @@ class Sequence(object):
             test_generator = DataGenerator(x_test, y_test, 
               batch_size=self.training_config.batch_size, preprocessor=self.p, 
               char_embed_size=self.model_config.char_embedding_size, 
-              embeddings=self.embeddings, shuffle=False)
+              embeddings=self.embeddings, shuffle=False, 
+              bucket_by_length=self.training_config.bucket_by_length)
 
             # Build the evaluator and evaluate the model
             scorer = Scorer(test_generator, self.p, evaluation=True)
@@ -193,7 +223,8 @@ class Sequence(object):
                 test_generator = DataGenerator(x_test, y_test, 
                   batch_size=self.training_config.batch_size, preprocessor=self.p, 
                   char_embed_size=self.model_config.char_embedding_size, 
-                  embeddings=self.embeddings, shuffle=False)
+                  embeddings=self.embeddings, shuffle=False, 
+                  bucket_by_length=self.training_config.bucket_by_length)
 
                 # Build the evaluator and evaluate the model
                 scorer = Scorer(test_generator, self.p, evaluation=True)
@@ -233,7 +264,8 @@ class Sequence(object):
 
     def tag(self, texts, output_format):
         if self.model:
-            tagger = Tagger(self.model, self.model_config, self.embeddings, preprocessor=self.p)
+            tagger = Tagger(self.model, self.model_config, self.embeddings, preprocessor=self.p, 
+                bucket_by_length=self.training_config.bucket_by_length)
             return tagger.tag(texts, output_format)
         else:
             raise (OSError('Could not find a model.'))
@@ -256,13 +288,37 @@ class Sequence(object):
         print('model saved')
 
 
-    def load(self, dir_path='data/models/sequenceLabelling/'):
+    def save_embeddings_subset(self, x_train, top_n=0, dir_path='data/models/sequenceLabelling/'):
+        """
+        Save next to the model the subset of the embeddings covering the tokens of the training 
+        corpus and the top_n most frequent words of the embeddings, so that the model can be 
+        loaded without the full embeddings (see load(use_embeddings_subset=True))
+        """
+        words = set()
+        for tokens in x_train:
+            for token in tokens:
+                words.add(token)
+                # the numbers are normalized before the embeddings lookup
+                words.add(_normalize_num(token))
+        directory = os.path.join(dir_path, self.model_config.model_name)
+        self.embeddings.make_embeddings_subset(sorted(words), directory, top_n=top_n)
+
+    def load(self, dir_path='data/models/sequenceLabelling/', embeddings=None, use_embeddings_subset=False):
         self.p = WordPreprocessor.load(os.path.join(dir_path, self.model_config.model_name, self.preprocessor_file))
         
         self.model_config = ModelConfig.load(os.path.join(dir_path, self.model_config.model_name, self.config_file))
 
-        # load embeddings
-        self.embeddings = Embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo) 
+        # load embeddings, except if already loaded embeddings are provided (e.g. shared by several models)
+        if embeddings is None:
+            subset_path = None
+            if use_embeddings_subset:
+                subset_path = os.path.join(dir_path, self.model_config.model_name)
+                if not os.path.isfile(os.path.join(subset_path, subset_vocab_file)):
+                    print("Warning: no embeddings subset saved with the model, the full embeddings are used")
+                    subset_path = None
+            embeddings = Embeddings(self.model_config.embeddings_name, use_ELMo=self.model_config.use_ELMo, 
+                subset_path=subset_path) 
+        self.embeddings = embeddings
         self.model_config.word_embedding_size = self.embeddings.embed_size
 
         self.model = get_model(self.model_config, self.p, ntags=len(self.p.vocab_tag))
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+try:
+    import sequenceLabelling.preprocess as preprocess
+    from sequenceLabelling.preprocess import WordPreprocessor, pad_sequences
+except ImportError:
+    preprocess = None
+
+
+@unittest.skipUnless(preprocess is not None, "scikit-learn or TensorFlow is not available")
+class CharIdArrayTest(unittest.TestCase):
+    """
+    The char ids gathered from the memoized rows must be the ones padded by pad_sequences()
+    """
+
+    train = [['The', 'cat', 'sat', 'on', 'the', 'mat', '.'], ['Anticonstitutionnellement', 'dit-il']]
+    batches = [
+        [['The', 'dog', 'sat', '.'], ['on', 'a', 'mat'], ['Unknown', 'chars', ':', 'ÿø']],
+        [['Anticonstitutionnellement'], ['the', 'the', 'cat'], []],
+        [['a']]
+    ]
+
+    def setUp(self):
+        self.preprocessor = WordPreprocessor(max_char_length=10)
+        self.preprocessor.fit(self.train, [['O'] * len(sent) for sent in self.train])
+
+    def _expected(self, X, width):
+        chars = [[self.preprocessor.get_char_ids(w) for w in sent] for sent in X]
+        char_ids, _ = pad_sequences(chars, pad_tok=0, nlevels=2, max_char_length=width)
+        return np.asarray(char_ids)
+
+    def test_same_as_pad_sequences(self):
+        for X in self.batches:
+            max_length = max(len(sent) for sent in X)
+            char_ids = self.preprocessor.get_char_id_array(X, max_length)
+            self.assertEqual(char_ids.dtype, np.int32)
+            np.testing.assert_array_equal(char_ids, self._expected(X, 10))
+
+    def test_output_array(self):
+        X = self.batches[0]
+        out = np.zeros((len(X), 4, 10), dtype=np.int32)
+        result = self.preprocessor.get_char_id_array(X, 4, out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, self._expected(X, 10))
+
+    def test_dynamic_char_length(self):
+        self.preprocessor.dynamic_char_length = True
+        for X in self.batches:
+            width = self.preprocessor.get_char_width(X)
+            self.assertEqual(width, min(max([len(w) for sent in X for w in sent] + [1]), 10))
+            char_ids = self.preprocessor.get_char_id_array(X, max(len(sent) for sent in X))
+            np.testing.assert_array_equal(char_ids, self._expected(X, width))
+
+    def test_cache_growth_and_reset(self):
+        words = ['w' + str(i) for i in range(3000)]
+        X = [words[i:i+100] for i in range(0, len(words), 100)]
+        cache_size = preprocess.word_cache_size
+        preprocess.word_cache_size = 2500
+        try:
+            for batch in [X[:10], X[10:20], X[20:], X[:10]]:
+                char_ids = self.preprocessor.get_char_id_array(batch, 100)
+                np.testing.assert_array_equal(char_ids, self._expected(batch, 10))
+        finally:
+            preprocess.word_cache_size = cache_size
+
+    def test_transform(self):
+        X = self.batches[0]
+        (char_ids, lengths), y = self.preprocessor.transform(X, [['O'] * len(sent) for sent in X])
+        np.testing.assert_array_equal(char_ids, self._expected(X, 10))
+        np.testing.assert_array_equal(lengths, np.array([[4], [3], [4]], dtype=np.int32))
+        self.assertEqual(y.shape, (3, 4, len(self.preprocessor.vocab_tag)))
+
+
+if __name__ == '__main__':
+    unittest.main()
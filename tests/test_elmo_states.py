@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import tensorflow
+except ImportError:
+    tensorflow = None
+
+# the ELMo model of the embeddings registry of the repository
+registry_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'embedding-registry.json')
+
+
+def _get_ELMo_description():
+    with open(registry_path) as f:
+        registry = json.load(f)
+    for description in registry.get("embeddings-contextualized", []):
+        if description["name"] == 'elmo-en':
+            return description
+    return None
+
+
+def _is_ELMo_available():
+    if tensorflow is None:
+        return False
+    description = _get_ELMo_description()
+    return description is not None and os.path.isfile(description["path-config"]) and \
+        os.path.isfile(description["path_weights"]) and os.path.isfile(description["path-vocab"])
+
+
+@unittest.skipUnless(_is_ELMo_available(), "TensorFlow or the ELMo model of the embeddings registry is not available")
+class ELMoStatesTest(unittest.TestCase):
+    """
+    The LSTMs of the biLM are stateful: the ELMo representations of a sentence must not depend
+    on the sentences run before it in the same session
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from utilities.Embeddings import Embeddings
+
+        cls.working_path = tempfile.mkdtemp()
+        # small static embeddings loaded in memory, the ELMo dump and cache in a temporary directory
+        vec_path = os.path.join(cls.working_path, 'words.vec')
+        with open(vec_path, 'w') as f:
+            f.write('2 3\nthe 0.1 0.2 0.3\ncat 0.4 0.5 0.6\n')
+        description = dict(_get_ELMo_description())
+        description["path-dump"] = cls.working_path
+        registry = {
+            "embeddings": [{"name": "test", "path": vec_path, "type": "fasttext", "format": "vec",
+                            "lang": "en", "item": "word"}],
+            "embeddings-contextualized": [description],
+            "embedding-lmdb-path": None
+        }
+        path = os.path.join(cls.working_path, 'registry.json')
+        with open(path, 'w') as f:
+            json.dump(registry, f)
+        cls.embeddings = Embeddings('test', path=path, use_ELMo=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.embeddings.close()
+        shutil.rmtree(cls.working_path)
+
+    sentence = ['The', 'cat', 'sat', 'on', 'the', 'mat', '.']
+    others = [['A', 'first', 'unrelated', 'sentence', 'run', 'before'],
+              ['and', 'a', 'longer', 'one', 'with', 'many', 'more', 'tokens', 'than', 'the', 'others', '.']]
+
+    def test_same_vectors_whatever_was_run_before(self):
+        first = self.embeddings._run_ELMo([self.sentence])
+        self.embeddings._run_ELMo(self.others)
+        self.embeddings._run_ELMo(self.others[1:])
+        second = self.embeddings._run_ELMo([self.sentence])
+        np.testing.assert_allclose(first, second, rtol=1e-5, atol=1e-5)
+
+    def test_same_vectors_whatever_the_order_of_the_batches(self):
+        self.embeddings._run_ELMo(self.others)
+        after_others = self.embeddings._run_ELMo([self.sentence])
+        self.embeddings._run_ELMo([self.sentence])
+        after_itself = self.embeddings._run_ELMo([self.sentence])
+        np.testing.assert_allclose(after_others, after_itself, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
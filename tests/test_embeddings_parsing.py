@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utilities.Embeddings import Embeddings, _parse_embeddings_chunk, _count_vector_values
+
+
+class EmbeddingsParsingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.working_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_path)
+
+    def _write(self, content):
+        path = os.path.join(self.working_path, 'embeddings.vec')
+        with open(path, 'w', encoding='UTF-8', newline='\n') as f:
+            f.write(content)
+        return path
+
+    def _parse(self, content, dim):
+        path = self._write(content)
+        return _parse_embeddings_chunk((path, 0, os.path.getsize(path), dim))
+
+    def test_lines(self):
+        words, vectors, nb_bytes = self._parse('the 0.1 0.2 0.3\ncat -1 2e-3 4\n', 3)
+        self.assertEqual(words, ['the', 'cat'])
+        np.testing.assert_array_equal(vectors, np.array([[0.1, 0.2, 0.3], [-1, 2e-3, 4]], dtype=np.float32))
+        self.assertEqual(nb_bytes, 30)
+
+    def test_tokens_with_spaces(self):
+        words, vectors, _ = self._parse('. . . 1 2\nnew york 3 4\nthe 5 6\n', 2)
+        self.assertEqual(words, ['. . .', 'new york', 'the'])
+        np.testing.assert_array_equal(vectors, np.array([[1, 2], [3, 4], [5, 6]], dtype=np.float32))
+
+    def test_trailing_space_and_crlf(self):
+        words, vectors, _ = self._parse('the 1 2 \r\ncat 3 4\r\n', 2)
+        self.assertEqual(words, ['the', 'cat'])
+        np.testing.assert_array_equal(vectors, np.array([[1, 2], [3, 4]], dtype=np.float32))
+
+    def test_malformed_lines(self):
+        # short line, non numerical value, empty line and line without word
+        words, vectors, _ = self._parse('the 1 2\nshort 3\nbad 4 x\n\n 5 6\ncat 7 8\n', 2)
+        self.assertEqual(words, ['the', 'cat'])
+        np.testing.assert_array_equal(vectors, np.array([[1, 2], [7, 8]], dtype=np.float32))
+
+    def test_only_malformed_lines(self):
+        words, vectors, _ = self._parse('short 3\n', 2)
+        self.assertEqual(words, [])
+        self.assertEqual(vectors.shape, (0, 2))
+
+    def test_count_vector_values(self):
+        self.assertEqual(_count_vector_values('the 0.1 0.2 0.3'.split(' ')), 3)
+        self.assertEqual(_count_vector_values('. . . 0.1 0.2'.split(' ')), 2)
+        # the first token is always part of the word
+        self.assertEqual(_count_vector_values('1 2 3'.split(' ')), 2)
+
+    def _read_file(self, content, hasHeader):
+        path = self._write(content)
+        embeddings = Embeddings.__new__(Embeddings)
+        chunks = list(embeddings._read_embeddings_file(path, hasHeader, nb_workers=2, chunk_size=16))
+        words = [word for chunk_words, _ in chunks for word in chunk_words]
+        vectors = np.concatenate([chunk_vectors for _, chunk_vectors in chunks])
+        return embeddings.embed_size, words, vectors
+
+    def test_file_with_header(self):
+        embed_size, words, vectors = self._read_file('3 2\nthe 1 2\nnew york 3 4\ncat 5 6\n', True)
+        self.assertEqual((embed_size, words), (2, ['the', 'new york', 'cat']))
+        np.testing.assert_array_equal(vectors, np.array([[1, 2], [3, 4], [5, 6]], dtype=np.float32))
+
+    def test_file_without_header(self):
+        # the vector size is given by the values of the first line, whose word contains spaces
+        embed_size, words, vectors = self._read_file('. . . 1 2\nthe 3 4\nnew york 5 6\n', False)
+        self.assertEqual((embed_size, words), (2, ['. . .', 'the', 'new york']))
+        np.testing.assert_array_equal(vectors, np.array([[1, 2], [3, 4], [5, 6]], dtype=np.float32))
+
+
+if __name__ == '__main__':
+    unittest.main()
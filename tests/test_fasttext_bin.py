@@ -0,0 +1,127 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from utilities.Embeddings import _fasttext_ngram_hashes, _read_fasttext_bin_header, _fasttext_bin_word_vectors
+
+
+def _write_fasttext_bin(path, words, dim, bucket, minn, maxn, input_matrix, new_format=True):
+    """
+    Write a minimal fastText .bin file (the model parameters, the dictionary, the input matrix
+    and an empty output matrix), as saved by fastText 0.9 or, with new_format False, by the
+    versions before the magic number
+    """
+    with open(path, 'wb') as f:
+        if new_format:
+            f.write(struct.pack('<2i', 793712314, 12))
+        # dim, ws, epoch, minCount, neg, wordNgrams, loss, model, bucket, minn, maxn, lrUpdateRate, t
+        f.write(struct.pack('<12id', dim, 5, 5, 1, 5, 1, 1, 2, bucket, minn, maxn, 100, 1e-4))
+        # size, nwords, nlabels, ntokens
+        f.write(struct.pack('<3iq', len(words), len(words), 0, 1000))
+        if new_format:
+            # pruneidx_size
+            f.write(struct.pack('<q', -1))
+        for i, word in enumerate(words):
+            # word, count, type
+            f.write(word.encode('UTF-8') + b'\x00' + struct.pack('<qb', 100 - i, 0))
+        if new_format:
+            # quant_input
+            f.write(struct.pack('<?', False))
+        f.write(struct.pack('<2q', *input_matrix.shape))
+        f.write(input_matrix.astype('<f4').tobytes())
+        if new_format:
+            # qout
+            f.write(struct.pack('<?', False))
+        f.write(struct.pack('<2q', len(words), dim))
+        f.write(np.zeros((len(words), dim), dtype='<f4').tobytes())
+
+
+class FastTextNgramHashesTest(unittest.TestCase):
+    """
+    The n-gram buckets must be the ones of fastText, the expected values are given by
+    get_subwords() of the fastText Python module for a model with 10007 buckets
+    """
+
+    def test_ascii_word(self):
+        self.assertEqual(_fasttext_ngram_hashes('the', 3, 6, 10007), [8544, 3094, 484, 8862, 717, 8632])
+
+    def test_word_with_two_bytes_characters(self):
+        self.assertEqual(_fasttext_ngram_hashes('café', 3, 6, 10007),
+            [428, 5515, 3633, 397, 3846, 6252, 7902, 3078, 3784, 5302])
+        self.assertEqual(_fasttext_ngram_hashes('zürich', 3, 6, 10007),
+            [3113, 5622, 9225, 739, 7535, 7353, 2232, 3340, 1316, 9263, 6520, 2437, 4574, 3879, 1696, 4586, 9625, 4767])
+
+    def test_word_with_three_bytes_characters(self):
+        self.assertEqual(_fasttext_ngram_hashes('東京', 3, 6, 10007), [5200, 3636, 8336])
+
+    def test_short_word(self):
+        self.assertEqual(_fasttext_ngram_hashes('a', 3, 6, 10007), [7399])
+
+    def test_no_ngrams(self):
+        self.assertEqual(_fasttext_ngram_hashes('</s>', 3, 6, 10007), [])
+        self.assertEqual(_fasttext_ngram_hashes('the', 3, 0, 10007), [])
+
+
+class FastTextBinTest(unittest.TestCase):
+    """
+    Parse a tiny .bin file, the expected rows of the input matrix of each word are given by
+    get_subwords() of the fastText Python module for this file
+    """
+
+    words = ['</s>', 'the', 'café']
+    dim = 4
+    bucket = 50
+    rows = {
+        'the': [1, 4, 29, 13, 33, 37, 33],
+        'café': [2, 50, 34, 42, 14, 4, 38, 15, 15, 50],
+        'zürich': [11, 35, 26, 51, 24, 23, 18, 29, 5, 8, 22, 30, 4, 42, 31],
+        '東京': [14, 22, 18]
+    }
+
+    def setUp(self):
+        self.working_path = tempfile.mkdtemp()
+        self.input_matrix = (np.arange((len(self.words) + self.bucket) * self.dim) % 17 / 16.0)
+        self.input_matrix = self.input_matrix.reshape((-1, self.dim)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_path)
+
+    def _write(self, new_format=True):
+        path = os.path.join(self.working_path, 'tiny.bin')
+        _write_fasttext_bin(path, self.words, self.dim, self.bucket, 3, 5, self.input_matrix, new_format)
+        return path
+
+    def test_header(self):
+        for new_format in [True, False]:
+            path = self._write(new_format)
+            header = _read_fasttext_bin_header(path)
+            self.assertEqual(header["words"], self.words)
+            self.assertEqual((header["dim"], header["nb_words"], header["nb_rows"]),
+                (self.dim, len(self.words), len(self.words) + self.bucket))
+            self.assertEqual((header["bucket"], header["minn"], header["maxn"]), (self.bucket, 3, 5))
+            matrix = np.memmap(path, dtype='<f4', mode='r', offset=header["matrix_offset"],
+                shape=(header["nb_rows"], header["dim"]))
+            np.testing.assert_array_equal(matrix, self.input_matrix)
+
+    def test_ngram_rows(self):
+        for word, rows in self.rows.items():
+            in_vocabulary = word in self.words
+            hashes = _fasttext_ngram_hashes(word, 3, 5, self.bucket)
+            self.assertEqual([len(self.words) + h for h in hashes], rows[1:] if in_vocabulary else rows)
+
+    def test_word_vectors(self):
+        path = self._write()
+        header = _read_fasttext_bin_header(path)
+        words = header.pop("words")
+        words, vectors = _fasttext_bin_word_vectors((path, header, 1, words[1:]))
+        self.assertEqual(words, ['the', 'café'])
+        for word, vector in zip(words, vectors):
+            np.testing.assert_allclose(vector, self.input_matrix[self.rows[word]].mean(axis=0), rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+try:
+    from sequenceLabelling.data_generator import DataGenerator, get_length_buckets, padding_ratio
+except ImportError:
+    DataGenerator = None
+
+
+@unittest.skipUnless(DataGenerator is not None, "Keras or TensorFlow is not available")
+class LengthBucketsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lengths = np.random.RandomState(7).randint(1, 100, size=1003)
+
+    def _check_partition(self, batches, batch_size):
+        self.assertEqual(sorted(np.concatenate(batches).tolist()), list(range(len(self.lengths))))
+        self.assertTrue(all(len(batch) <= batch_size for batch in batches))
+        self.assertEqual(len(batches), (len(self.lengths) + batch_size - 1) // batch_size)
+
+    def test_sorted_without_shuffle(self):
+        batches = get_length_buckets(self.lengths, 20, shuffle=False)
+        self._check_partition(batches, 20)
+        ordered = self.lengths[np.concatenate(batches)]
+        self.assertTrue(np.all(ordered[1:] >= ordered[:-1]))
+
+    def test_shuffle(self):
+        batches = get_length_buckets(self.lengths, 20, shuffle=True, random_state=np.random.RandomState(1))
+        self._check_partition(batches, 20)
+        # same batches for the same random state, others for another one
+        same = get_length_buckets(self.lengths, 20, shuffle=True, random_state=np.random.RandomState(1))
+        other = get_length_buckets(self.lengths, 20, shuffle=True, random_state=np.random.RandomState(2))
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(batches, same)))
+        self.assertFalse(all(np.array_equal(a, b) for a, b in zip(batches, other)))
+
+    def test_padding_ratio(self):
+        lengths = np.array([1, 3, 2, 2])
+        # batches padded to 3 and 2: 8 tokens in 10 positions
+        self.assertAlmostEqual(padding_ratio(lengths, [np.array([0, 1]), np.array([2, 3])]), 0.2)
+        # empty batches are ignored
+        self.assertEqual(padding_ratio(lengths, [np.array([0]), np.array([], dtype='int64')]), 0.0)
+        self.assertEqual(padding_ratio(lengths, []), 0.0)
+
+    def test_less_padding_than_contiguous_batches(self):
+        contiguous = [np.arange(start, min(start + 20, len(self.lengths))) for start in range(0, len(self.lengths), 20)]
+        batches = get_length_buckets(self.lengths, 20, shuffle=True, random_state=np.random.RandomState(1))
+        self.assertLess(padding_ratio(self.lengths, batches), padding_ratio(self.lengths, contiguous) / 2)
+
+    def test_restore_order(self):
+        x = [['w'] * length for length in self.lengths[:103]]
+        for shuffle in [False, True]:
+            generator = DataGenerator(x, None, batch_size=10, shuffle=shuffle, bucket_by_length=True)
+            # the output of a sequence is its index in the data
+            batch_outputs = [generator.get_batch_indices(i) for i in range(len(generator))]
+            self.assertEqual(generator.restore_order(batch_outputs), list(range(len(x))))
+
+    def test_batch_indices_without_buckets(self):
+        generator = DataGenerator([['w']] * 25, None, batch_size=10, shuffle=False)
+        self.assertEqual([generator.get_batch_indices(i).tolist() for i in range(len(generator))],
+            [list(range(10)), list(range(10, 20)), list(range(20, 25))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from utilities.Embeddings import VectorCache
+
+
+class VectorCacheTest(unittest.TestCase):
+
+    def test_eviction_by_number_of_entries(self):
+        cache = VectorCache(max_entries=2)
+        cache.put('a', np.zeros(4, dtype=np.float32))
+        cache.put('b', np.ones(4, dtype=np.float32))
+        # 'a' becomes the most recently used
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', np.ones(4, dtype=np.float32))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = VectorCache(max_bytes=40)
+        for word in ['a', 'b', 'c']:
+            # 16 bytes per vector
+            cache.put(word, np.zeros(4, dtype=np.float32))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 32, 1))
+        self.assertIsNone(cache.get('a'))
+
+    def test_replaced_entry_is_not_counted_twice(self):
+        cache = VectorCache(max_bytes=40)
+        cache.put('a', np.zeros(4, dtype=np.float32))
+        cache.put('a', np.zeros(8, dtype=np.float32))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (1, 32, 0))
+
+    def test_stats(self):
+        cache = VectorCache()
+        self.assertEqual(cache.stats()["hit_rate"], 0.0)
+        cache.put('a', np.zeros(4, dtype=np.float32))
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.get('a')
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 0.75)
+        self.assertAlmostEqual(stats["miss_rate"], 0.25)
+        cache.clear()
+        self.assertEqual((cache.stats()["entries"], cache.stats()["bytes"]), (0, 0))
+
+    def test_cached_vectors_are_read_only(self):
+        cache = VectorCache()
+        cache.put('a', np.zeros(4, dtype=np.float32))
+        vector = cache.get('a')
+        self.assertFalse(vector.flags.writeable)
+        with self.assertRaises(ValueError):
+            vector[0] = 1.0
+        np.testing.assert_array_equal(cache.get('a'), np.zeros(4, dtype=np.float32))
+
+
+if __name__ == '__main__':
+    unittest.main()
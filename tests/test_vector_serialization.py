@@ -0,0 +1,59 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from utilities.Embeddings import _serialize_vector, _deserialize_vector
+
+
+class VectorSerializationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vector = np.random.RandomState(7).randn(300).astype(np.float32)
+        # per-layer ELMo vectors of a sentence
+        self.layers = np.random.RandomState(7).randn(3, 5, 16).astype(np.float32)
+
+    def test_float32_round_trip(self):
+        for array in [self.vector, self.layers]:
+            result = _deserialize_vector(_serialize_vector(array))
+            self.assertEqual(result.dtype, np.float32)
+            np.testing.assert_array_equal(result, array)
+
+    def test_raw_size(self):
+        self.assertLess(len(_serialize_vector(self.vector)) - self.vector.nbytes, 16)
+
+    def test_buffer_is_not_copied(self):
+        serialized = bytearray(_serialize_vector(self.vector))
+        result = _deserialize_vector(memoryview(serialized))
+        np.testing.assert_array_equal(result, self.vector)
+        self.assertFalse(result.flags.owndata)
+
+    def test_float16_round_trip(self):
+        for array in [self.vector, self.layers]:
+            serialized = _serialize_vector(array, 'float16')
+            self.assertLess(len(serialized), array.nbytes // 2 + 32)
+            result = _deserialize_vector(serialized)
+            self.assertEqual((result.dtype, result.shape), (np.float32, array.shape))
+            np.testing.assert_array_equal(result, array.astype(np.float16).astype(np.float32))
+
+    def test_int8_round_trip(self):
+        for array in [self.vector, self.layers]:
+            serialized = _serialize_vector(array, 'int8')
+            result = _deserialize_vector(serialized)
+            self.assertEqual((result.dtype, result.shape), (np.float32, array.shape))
+            # one scale per vector (last axis), the error is at most half a quantization step
+            scales = np.abs(array).max(axis=-1, keepdims=True) / 127.0
+            self.assertTrue(np.all(np.abs(result - array) <= scales / 2 + 1e-6))
+
+    def test_int8_zero_vector(self):
+        result = _deserialize_vector(_serialize_vector(np.zeros(8, dtype=np.float32), 'int8'))
+        np.testing.assert_array_equal(result, np.zeros(8, dtype=np.float32))
+
+    def test_pickled_vector(self):
+        # values stored by the former versions
+        np.testing.assert_array_equal(_deserialize_vector(pickle.dumps(self.vector)), self.vector)
+        np.testing.assert_array_equal(_deserialize_vector(memoryview(pickle.dumps(self.layers))), self.layers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,7 +10,7 @@ from textClassification.preprocess import to_vector_single
 
 class DataGenerator(keras.utils.Sequence):
     'Generates data for Keras'
-    def __init__(self, x, y, batch_size=256, maxlen=300, list_classes=[], embeddings=(), shuffle=True):
+    def __init__(self, x, y, batch_size=256, maxlen=300, list_classes=[], embeddings=(), shuffle=True, seed=7):
         'Initialization'
         self.x = x
         self.y = y
@@ -19,6 +19,10 @@ class DataGenerator(keras.utils.Sequence):
         self.embeddings = embeddings
         self.list_classes = list_classes
         self.shuffle = shuffle
+        # the order of the samples of an epoch only depends on the seed and the epoch number
+        self.seed = seed
+        self.epoch = 0
+        self.permutation = None
         self.on_epoch_end()
 
     def __len__(self):
@@ -32,19 +36,12 @@ class DataGenerator(keras.utils.Sequence):
         batch_x, batch_y = self.__data_generation(index)
         return batch_x, batch_y
 
-    def shuffle_pair(self, a, b):
-        # generate permutation index array
-        permutation = np.random.permutation(a.shape[0])
-        # shuffle the two arrays
-        return a[permutation], b[permutation]
-
     def on_epoch_end(self):
-        # shuffle dataset at each epoch
+        # shuffle dataset at each epoch, as a permutation of the sample indices, the data being never 
+        # copied or reordered
         if self.shuffle == True:
-            if self.y is None:
-                np.random.shuffle(self.x)
-            else:      
-                self.shuffle_pair(self.x,self.y)
+            self.permutation = np.random.RandomState(self.seed + self.epoch).permutation(len(self.x))
+        self.epoch += 1
 
     def __data_generation(self, index):
         'Generates data containing batch_size samples' 
@@ -55,14 +52,20 @@ class DataGenerator(keras.utils.Sequence):
         if self.y is not None:
             batch_y = np.zeros((max_iter, len(self.list_classes)), dtype='float32')
 
+        start = index*self.batch_size
+        if self.permutation is None:
+            indices = range(start, start+max_iter)
+        else:
+            indices = self.permutation[start:start+max_iter]
+
         # Generate data
-        for i in range(0, max_iter):
+        for i, sample in enumerate(indices):
             # Store sample
-            batch_x[i] = to_vector_single(self.x[(index*self.batch_size)+i], self.embeddings, self.maxlen)
+            batch_x[i] = to_vector_single(self.x[sample], self.embeddings, self.maxlen)
             
             # Store class
             # classes are numerical, so nothing to vectorize for y
             if self.y is not None:
-                batch_y[i] = self.y[(index*self.batch_size)+i]
+                batch_y[i] = self.y[sample]
      
         return batch_x, batch_y
\ No newline at end of file
@@ -21,12 +21,13 @@ def to_vector_single(text, embeddings, maxlen=300):
     window = tokens[-maxlen:]
     
     # TBD: use better initializers (uniform, etc.) 
-    x = np.zeros((maxlen, embeddings.embed_size), )
+    x = np.zeros((maxlen, embeddings.embed_size), dtype=np.float32)
 
     # TBD: padding should be left and which vector do we use for padding? 
     # and what about masking padding later for RNN?
-    for i, word in enumerate(window):
-        x[i,:] = embeddings.get_word_vector(word).astype('float32')
+    if len(window) > 0:
+        # all the vectors of the sequence are retrieved with one single batch lookup
+        x[:len(window)] = embeddings.get_word_vectors(window)
 
     return x
 
@@ -1,6 +1,5 @@
 # Manage pre-trained embeddings 
 
-from keras.preprocessing import text, sequence
 import numpy as np
 import sys
 import os
@@ -10,32 +9,89 @@ import lmdb
 import io
 import pickle
 import hashlib, struct
+import shutil
+import threading
+import argparse
+import multiprocessing
+import atexit
+import weakref
+from collections import OrderedDict, deque
 from tqdm import tqdm
 import mmap
-import tensorflow as tf
-import keras.backend as K
 
-# for ELMo embeddings
-from utilities.bilm.data import Batcher, TokenBatcher
-from utilities.bilm.model import BidirectionalLanguageModel, dump_token_embeddings
-from utilities.bilm.elmo import weight_layers
+# TensorFlow and the biLM of ELMo embeddings are imported only when ELMo is used, they take 
+# seconds to import
 
 from utilities.Tokenizer import tokenizeAndFilterSimple
 
-# gensim is used to exploit .bin FastText embeddings, in particular the OOV with the provided ngrams
-#from gensim.models import FastText
-
 # this is the default init size of a lmdb database for embeddings
 # based on https://github.com/kermitt2/nerd/blob/master/src/main/java/com/scienceminer/nerd/kb/db/KBDatabase.java
 # and https://github.com/kermitt2/nerd/blob/0.0.3/src/main/java/com/scienceminer/nerd/kb/db/KBDatabaseFactory.java#L368
 map_size = 100 * 1024 * 1024 * 1024 
 
+# raw vector values stored in LMDB: a 4 bytes header (magic, data type code, number of 
+# dimensions) followed by each dimension as uint32 and by the little-endian vector data, 
+# so that a value can be decoded directly from the LMDB memory map with np.frombuffer. 
+# For int8 quantization, the data is preceded by one float32 scale per vector. 
+_vector_magic = b'DV'
+_vector_header = struct.Struct('<2sBB')
+_vector_dtypes = [np.dtype('<f4'), np.dtype('<f2'), np.dtype('int8')]
+
+# supported quantization of the stored vectors (None meaning float32) and data type code
+_quantizations = {None: 0, 'float16': 1, 'int8': 2}
+
+# supported formats of the embeddings files: text (word followed by its vector values on each 
+# line) or fastText binary
+_formats = ['vec', 'bin']
+
+# row index of a word in the matrix file of the memory-mapped storage, as stored in the word index
+_row_index = struct.Struct('<I')
+
+# magic number starting the fastText .bin files since fastText 0.2, former files starting directly 
+# with the embeddings dimension
+_fasttext_magic = 793712314
+
+# files of a task-specific subset of embeddings, saved in the directory of a model
+subset_vocab_file = 'embeddings-subset-vocab.txt'
+subset_vectors_file = 'embeddings-subset-vectors.npy'
+
+# LMDB environments opened by the current process, by path, with the pid of this process
+_envs = {}
+_envs_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'):
+    # the lock is never inherited in locked state by a child process
+    os.register_at_fork(before=_envs_lock.acquire, after_in_parent=_envs_lock.release, 
+        after_in_child=_envs_lock.release)
+
+# default size limit in bytes of the ELMo embeddings cache
+default_ELMo_cache_max_bytes = 20 * 1024 * 1024 * 1024
+
+# counters of the ELMo embeddings cache (access ticks, size), big-endian so that the tick keys 
+# are ordered by LMDB from the least recently used
+_uint64 = struct.Struct('>Q')
+
+# databases of the ELMo cache, stored as keys of the main database of its environment
+_ELMo_cache_dbs = (b'vectors', b'access', b'lru', b'counters')
+
 # dim of ELMo embeddings (2 times the dim of the LSTM for LM)
 ELMo_embed_size = 1024
 
+# number of layers of the ELMo biLM (char CNN and 2 LSTM layers)
+ELMo_nb_layers = 3
+
+# the sentences of a batch are run by the biLM in buckets of similar lengths, the longest 
+# sentence of a bucket being at most ELMo_bucket_ratio times or ELMo_bucket_min_width tokens 
+# longer than the shortest one
+ELMo_bucket_ratio = 1.5
+ELMo_bucket_min_width = 8
+
 class Embeddings(object):
 
-    def __init__(self, name, path='./embedding-registry.json', lang='en', use_ELMo=False):
+    def __init__(self, name, path='./embedding-registry.json', lang='en', use_ELMo=False, 
+                 cache_max_entries=0, cache_max_bytes=0, quantization=None, subset_path=None, 
+                 oov_cache_max_entries=100000, elmo_intra_op_threads=0, elmo_inter_op_threads=0, 
+                 elmo_cache_max_bytes=0, elmo_cache_quantization=None, use_ELMo_token_dump=None, 
+                 elmo_cache_layers=None):
         self.name = name
         self.embed_size = 0
         self.static_embed_size = 0
@@ -46,28 +102,142 @@ class Embeddings(object):
         self.embedding_lmdb_path = None
         if self.registry is not None:
             self.embedding_lmdb_path = self.registry["embedding-lmdb-path"]
-        self.env = None
-        self.make_embeddings_simple(name)
+        # the LMDB environments are given by their path and opened lazily in each process (see env)
+        self.env_path = None
+        # memory-mapped (vocab, dim) matrix and its word -> row index, for the "mmap" storage
+        self.matrix = None
+        self.scales = None
+        self.env_index_path = None
+        self.env_ELMo_path = None
+        # in-memory word -> row index, for a task-specific subset of the embeddings
+        self.word_rows = None
+        # char n-gram bucket vectors of fastText .bin embeddings, used to build OOV vectors
+        self.ngrams = None
+        self.ngram_scales = None
+        self.minn = 0
+        self.maxn = 0
+        self.bucket = 0
+        # quantization of the stored vectors, by default given by the embeddings registry
+        self.quantization = quantization
+        if subset_path is not None:
+            self.load_embeddings_subset(subset_path)
+        else:
+            self.make_embeddings_simple(name)
         self.static_embed_size = self.embed_size
+        # shared read-only vector returned for every OOV token
+        self.zero_vector = np.zeros((self.static_embed_size,), dtype=np.float32)
+        self.zero_vector.flags.writeable = False
+        # optional bounded cache of the static vectors retrieved from the db storage, sized by the 
+        # constructor or, per deployment, by the embeddings registry
+        self.cache = None
+        if self.registry is not None:
+            if cache_max_entries == 0:
+                cache_max_entries = self.registry.get("embedding-cache-max-entries", 0)
+            if cache_max_bytes == 0:
+                cache_max_bytes = self.registry.get("embedding-cache-max-bytes", 0)
+        if (cache_max_entries > 0 or cache_max_bytes > 0) and (self.env is not None or self.matrix is not None):
+            self.cache = VectorCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+        # the OOV vectors built from char n-grams are memoized, rare tokens being seen at each epoch
+        self.oov_cache = None
+        if self.ngrams is not None:
+            self.oov_cache = VectorCache(max_entries=oov_cache_max_entries)
         self.bilm = None
+        # long-lived session for the ELMo inference, with the TensorFlow thread pool sizes 
+        # (0 lets TensorFlow choose)
+        self.elmo_session = None
+        # op resetting the states of the stateful LSTMs of the biLM before each batch
+        self.elmo_reset_states_op = None
+        self.elmo_intra_op_threads = elmo_intra_op_threads
+        self.elmo_inter_op_threads = elmo_inter_op_threads
+        # context-independent ELMo token representations dumped for a vocabulary, with a padding 
+        # row 0, so that the char CNN is run only for the tokens out of this vocabulary
+        self.elmo_token_embeddings = None
+        # if True, the ELMo cache stores the outputs of each layer of the biLM, which are then 
+        # mixed in numpy with the layer weights (softmax normalized), the scale gamma and 
+        # optionally a layer normalization, as done by bilm weight_layers()
+        self.elmo_cache_layers = False
+        self.elmo_layer_weights = np.zeros((ELMo_nb_layers,), dtype=np.float32)
+        self.elmo_gamma = 1.0
+        self.elmo_layer_norm = False
 
         # below init for using ELMo embeddings
         self.use_ELMo = use_ELMo
         if use_ELMo:
             self.make_ELMo()
+            # if close() is not called explicitly, the ELMo session is closed and the access ticks 
+            # of the ELMo cache are flushed at exit
+            atexit.register(_close_at_exit, weakref.ref(self))
             self.embed_size = ELMo_embed_size + self.embed_size
             description = self._get_description('elmo-en')
-            self.env_ELMo = None
             if description:
+                # persistent cache of the ELMo embeddings of the sentences, bounded in size by 
+                # the constructor or by the "cache-max-bytes" field of the ELMo description 
+                # (least recently used vectors being evicted), optionally quantized
                 self.embedding_ELMo_cache = os.path.join(description["path-dump"], "cache")
-                # clean possible remaining cache
-                self.clean_ELMo_cache()
-                # create and load a cache in write mode, it will be used only for training
-                self.env_ELMo = lmdb.open(self.embedding_ELMo_cache, map_size=map_size)
+                self.env_ELMo_path = self.embedding_ELMo_cache
+                if elmo_cache_max_bytes == 0:
+                    elmo_cache_max_bytes = description.get("cache-max-bytes", default_ELMo_cache_max_bytes)
+                self.elmo_cache_max_bytes = elmo_cache_max_bytes
+                if elmo_cache_layers is None:
+                    elmo_cache_layers = description.get("cache-layers", False)
+                self.elmo_cache_layers = elmo_cache_layers
+                if elmo_cache_layers:
+                    if "layer-weights" in description:
+                        self.elmo_layer_weights = np.asarray(description["layer-weights"], dtype=np.float32)
+                    self.elmo_gamma = description.get("layer-gamma", self.elmo_gamma)
+                    self.elmo_layer_norm = description.get("layer-norm", self.elmo_layer_norm)
+                if elmo_cache_quantization is None:
+                    # the layers are 3 times bigger, they are stored as float16 by default
+                    elmo_cache_quantization = description.get("cache-quantization", 
+                        "float16" if elmo_cache_layers else None)
+                if elmo_cache_quantization == 'float32':
+                    elmo_cache_quantization = None
+                if elmo_cache_quantization not in _quantizations:
+                    raise ValueError('unsupported quantization of ELMo cache: ' + str(elmo_cache_quantization))
+                self.elmo_cache_quantization = elmo_cache_quantization
+                # the cached vectors are specific to the ELMo model
+                self.elmo_model_version = _ELMo_model_digest(description["path-config"], description["path_weights"])
+                # keys of the cached vectors read since the last update of the access ticks
+                self.elmo_cache_accessed = set()
+                self.elmo_cache_dbs = None
+                # the cache is written only by the process which created this object, the forked 
+                # workers of the data generators open it read-only and leave their vectors uncached
+                self.elmo_cache_owner = os.getpid()
+                # opened now so that the databases exist before any fork
+                self._get_ELMo_cache()
+                if use_ELMo_token_dump is None:
+                    use_ELMo_token_dump = description.get("token-dump", False)
+                if use_ELMo_token_dump:
+                    self.load_ELMo_token_dump()
 
     def __getattr__(self, name):
         return getattr(self.model, name)
 
+    # The LMDB environments are shared by all the Embeddings objects of a process and are reopened 
+    # lazily after a fork (e.g. in the multiprocessing workers of the data generators), an 
+    # environment being usable only in the process which opened it.
+
+    @property
+    def env(self):
+        if self.env_path is None:
+            return None
+        return _get_env(self.env_path)
+
+    @property
+    def env_index(self):
+        if self.env_index_path is None:
+            return None
+        return _get_env(self.env_index_path)
+
+    @property
+    def env_ELMo(self):
+        if self.env_ELMo_path is None:
+            return None
+        return _get_env(self.env_ELMo_path, readonly=not self._is_ELMo_cache_owner())
+
+    def _is_ELMo_cache_owner(self):
+        return self.env_ELMo_path is not None and self.elmo_cache_owner == os.getpid()
+
     def _load_embedding_registry(self, path='./embedding-registry.json'):
         """
         Load the description of available embeddings. Each description provides a name, 
@@ -89,6 +259,17 @@ class Embeddings(object):
             print("path:", embeddings_path)
             if embeddings_type == "glove":
                 hasHeader = False
+            if description.get("format") == "bin":
+                for words, vectors in self._read_fasttext_bin(embeddings_path):
+                    self.model.update(zip(words, vectors))
+                # the char n-gram bucket vectors are used directly from the .bin file
+                header = _read_fasttext_bin_header(embeddings_path)
+                if header["maxn"] > 0:
+                    self.ngrams = np.memmap(embeddings_path, dtype='<f4', mode='r', offset=header["matrix_offset"], 
+                        shape=(header["nb_rows"], self.embed_size))[header["nb_words"]:]
+                    self.minn, self.maxn, self.bucket = header["minn"], header["maxn"], header["bucket"]
+                print('embeddings loaded for', len(self.model), "words and", self.embed_size, "dimensions")
+                return
             with open(embeddings_path) as f:
                 for line in f:
                     line = line.split(' ')
@@ -113,23 +294,41 @@ class Embeddings(object):
                 nbWords = len(self.model)
             print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
 
-    
-    '''
-    def make_embeddings_fasttext_bin(self, name="wiki.en.bin"):
+    def make_embeddings_lmdb(self, name="fasttext-crawl", hasHeader=True):
         nbWords = 0
-        print('loading embeddings...')
+        print('\nCompiling embeddings... (this is done only one time per embeddings)')
         description = self._get_description(name)
         if description is not None:
             embeddings_path = description["path"]
+            embeddings_type = description["type"]
+            self.lang = description["lang"]
             print("path:", embeddings_path)
+            if embeddings_type == "glove":
+                hasHeader = False
+            # create and load the database in write mode
+            env = lmdb.open(self._get_store_path(name, "lmdb", self.quantization), map_size=map_size)
+            i = 0
+            for words, vectors in self._read_embeddings(description, hasHeader):
+                # one transaction per parsed chunk of the file
+                txn = env.begin(write=True)
+                for word, vector in zip(words, vectors):
+                    if len(word.encode(encoding='UTF-8')) < env.max_key_size():   
+                        txn.put(word.encode(encoding='UTF-8'), _serialize_vector(vector, self.quantization))
+                        i += 1
+                txn.commit()
+            env.close()
 
-        self.model = load_fasttext_format(embeddings_path)
-    '''
+            nbWords = i
+            self.vocab_size = nbWords
+            print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
 
-    def make_embeddings_lmdb(self, name="fasttext-crawl", hasHeader=True):
+    def make_embeddings_mmap(self, name="fasttext-crawl", hasHeader=True):
+        """
+        Compile the embeddings into a single float32 matrix file of shape (vocab, dim), which 
+        will be memory-mapped, and a compact LMDB index giving the row of each word
+        """
         nbWords = 0
         print('\nCompiling embeddings... (this is done only one time per embeddings)')
-        begin = True
         description = self._get_description(name)
         if description is not None:
             embeddings_path = description["path"]
@@ -138,67 +337,308 @@ class Embeddings(object):
             print("path:", embeddings_path)
             if embeddings_type == "glove":
                 hasHeader = False
-            txn = self.env.begin(write=True)
-            batch_size = 1024
+            store_path = self._get_store_path(name, "mmap", self.quantization)
+            if not os.path.exists(store_path):
+                os.makedirs(store_path)
+            env_index = lmdb.open(os.path.join(store_path, "index"), map_size=map_size)
             i = 0
-            nb_lines = 0
-            with open(embeddings_path) as f:
-                for line in f:
-                    nb_lines += 1
-
-            with open(embeddings_path) as f:
-                #for line in f:
-                for line in tqdm(f, total=nb_lines):
-                    line = line.split(' ')
-                    if begin:
-                        if hasHeader:
-                            # first line gives the nb of words and the embedding size
-                            nbWords = int(line[0])
-                            self.embed_size = int(line[1].replace("\n", ""))
-                            begin = False
-                            continue
-                        else:
-                            begin = False
-                    word = line[0]
-                    #if embeddings_type == 'glove':
-                    vector = np.array([float(val) for val in line[1:len(line)]], dtype='float32')
-                    #else:
-                    #    vector = np.array([float(val) for val in line[1:len(line)-1]], dtype='float32')
-                    if self.embed_size == 0:
-                        self.embed_size = len(vector)
-
-                    if len(word.encode(encoding='UTF-8')) < self.env.max_key_size():   
-                        txn.put(word.encode(encoding='UTF-8'), _serialize_pickle(vector))  
-                        #txn.put(word.encode(encoding='UTF-8'), _serialize_byteio(vector))
+            all_scales = []
+            with open(os.path.join(store_path, "vectors.bin"), "wb") as f_out:
+                for words, vectors in self._read_embeddings(description, hasHeader):
+                    # the rows of the matrix keep the order of the embeddings file
+                    keep = [len(word.encode(encoding='UTF-8')) < env_index.max_key_size() for word in words]
+                    txn = env_index.begin(write=True)
+                    for word in (word for word, kept in zip(words, keep) if kept):
+                        txn.put(word.encode(encoding='UTF-8'), _row_index.pack(i))
                         i += 1
+                    txn.commit()
+                    data, scales = _quantize(vectors[np.asarray(keep, dtype=bool)], self.quantization)
+                    f_out.write(data.tobytes())
+                    if scales is not None:
+                        all_scales.append(scales)
+            if len(all_scales) > 0:
+                # one scale per row for int8 quantization
+                np.concatenate(all_scales).tofile(os.path.join(store_path, "scales.bin"))
+            env_index.close()
+            if i == 0:
+                # an empty matrix file cannot be memory-mapped
+                raise ValueError('no vectors read from the embeddings file: ' + embeddings_path)
+
+            # the meta data file is written last, its presence indicates a complete compilation
+            with open(os.path.join(store_path, "meta.json"), "w") as f_meta:
+                json.dump({"vocab_size": i, "dim": self.embed_size, "dtype": _vector_dtypes[_quantizations[self.quantization]].name}, 
+                    f_meta, indent=4)
+            nbWords = i
+            print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
 
-                    # commit batch
-                    if i % batch_size == 0:
-                        txn.commit()
-                        txn = self.env.begin(write=True)
+    def _read_embeddings(self, description, hasHeader=True):
+        """
+        Generate the words and vectors of an embeddings file, given its registry description
+        """
+        if description.get("format") == "bin":
+            return self._read_fasttext_bin(description["path"])
+        return self._read_embeddings_file(description["path"], hasHeader)
 
-            #if i % batch_size != 0:
-            txn.commit()   
-            if nbWords == 0:
-                nbWords = i
-            self.vocab_size = nbWords
-            print('embeddings loaded for', nbWords, "words and", self.embed_size, "dimensions")
+    def _read_embeddings_file(self, embeddings_path, hasHeader=True, nb_workers=None, chunk_size=32 * 1024 * 1024):
+        """
+        Parse an embeddings file in a single pass, by splitting it into byte ranges parsed in 
+        parallel by a pool of processes. Generate for each range, in the order of the file, the 
+        list of words and the float32 matrix of their vectors. The progress is reported from 
+        the byte offsets, so the file does not need to be read beforehand to count its lines.  
+        """
+        file_size = os.path.getsize(embeddings_path)
+        with open(embeddings_path, 'rb') as f:
+            first_line_bytes = f.readline()
+        first_line = first_line_bytes.decode('UTF-8').rstrip().split(' ')
+        if hasHeader:
+            # first line gives the nb of words and the embedding size
+            self.embed_size = int(first_line[1])
+            data_start = len(first_line_bytes)
+        else:
+            # the values are counted from the end of the line, the word can contain spaces
+            self.embed_size = _count_vector_values(first_line)
+            data_start = 0
+
+        chunks = [(embeddings_path, start, end, self.embed_size) 
+            for start, end in _split_file(embeddings_path, data_start, chunk_size)]
+        if nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        nb_workers = max(1, min(nb_workers, len(chunks)))
+
+        pbar = tqdm(total=file_size, unit='B', unit_scale=True)
+        pbar.update(data_start)
+        pool = multiprocessing.Pool(nb_workers)
+        try:
+            # a bounded number of chunks is in progress, so that the parsed vectors do not 
+            # accumulate in memory when writing is slower than parsing
+            pending = deque()
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                while next_chunk < len(chunks) and len(pending) < 2 * nb_workers:
+                    pending.append(pool.apply_async(_parse_embeddings_chunk, (chunks[next_chunk],)))
+                    next_chunk += 1
+                words, vectors, nb_bytes = pending.popleft().get()
+                pbar.update(nb_bytes)
+                yield words, vectors
+        finally:
+            pool.terminate()
+            pbar.close()
+
+    def _read_fasttext_bin(self, embeddings_path, nb_workers=None, chunk_size=10000):
+        """
+        Generate by chunks the words of a fastText .bin file and their vectors, which are, like 
+        in fastText, the average of the input vectors of the word and of its char n-grams. The 
+        chunks are computed in parallel by a pool of processes. 
+        """
+        header = _read_fasttext_bin_header(embeddings_path)
+        self.embed_size = header["dim"]
+        # the words are given to the workers by chunks, not with the rest of the header
+        words = header.pop("words")
+        chunks = [(embeddings_path, header, start, words[start:start+chunk_size]) 
+            for start in range(0, len(words), chunk_size)]
+        if nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        nb_workers = max(1, min(nb_workers, len(chunks)))
+
+        pbar = tqdm(total=len(words))
+        pool = multiprocessing.Pool(nb_workers)
+        try:
+            for chunk_words, vectors in pool.imap(_fasttext_bin_word_vectors, chunks):
+                pbar.update(len(chunk_words))
+                yield chunk_words, vectors
+        finally:
+            pool.terminate()
+            pbar.close()
+
+    def make_embeddings_ngrams(self, name):
+        """
+        Store the char n-gram bucket vectors of fastText .bin embeddings as a matrix file of 
+        shape (bucket, dim), memory-mapped at lookup time to build the vectors of OOV words
+        """
+        print('\nCompiling char n-grams of embeddings... (this is done only one time per embeddings)')
+        embeddings_path = self._get_description(name)["path"]
+        header = _read_fasttext_bin_header(embeddings_path)
+        input_matrix = np.memmap(embeddings_path, dtype='<f4', mode='r', offset=header["matrix_offset"], 
+            shape=(header["nb_rows"], header["dim"]))
+        store_path = self._get_store_path(name, "ngrams", self.quantization)
+        if not os.path.exists(store_path):
+            os.makedirs(store_path)
+        all_scales = []
+        with open(os.path.join(store_path, "vectors.bin"), "wb") as f_out:
+            for start in tqdm(range(header["nb_words"], header["nb_rows"], 100000)):
+                data, scales = _quantize(input_matrix[start:start+100000], self.quantization)
+                f_out.write(data.tobytes())
+                if scales is not None:
+                    all_scales.append(scales)
+        if len(all_scales) > 0:
+            np.concatenate(all_scales).tofile(os.path.join(store_path, "scales.bin"))
+
+        # the meta data file is written last, its presence indicates a complete compilation
+        with open(os.path.join(store_path, "meta.json"), "w") as f_meta:
+            json.dump({"bucket": header["nb_rows"] - header["nb_words"], "dim": header["dim"], 
+                "dtype": _vector_dtypes[_quantizations[self.quantization]].name, 
+                "minn": header["minn"], "maxn": header["maxn"]}, f_meta, indent=4)
+
+    def load_embeddings_ngrams(self, name):
+        """
+        Open the memory-mapped char n-gram bucket vectors of fastText .bin embeddings
+        """
+        store_path = self._get_store_path(name, "ngrams", self.quantization)
+        with open(os.path.join(store_path, "meta.json")) as f_meta:
+            meta = json.load(f_meta)
+        if meta["maxn"] == 0 or meta["bucket"] == 0:
+            # embeddings trained without char n-grams
+            return
+        self.minn, self.maxn, self.bucket = meta["minn"], meta["maxn"], meta["bucket"]
+        self.ngrams = np.memmap(os.path.join(store_path, "vectors.bin"), dtype=meta["dtype"], 
+            mode='r', shape=(self.bucket, meta["dim"]))
+        if self.quantization == 'int8':
+            self.ngram_scales = np.memmap(os.path.join(store_path, "scales.bin"), dtype='<f4', mode='r', shape=(self.bucket,))
+
+    def load_embeddings_mmap(self, name):
+        """
+        Open the memory-mapped matrix and the word index of a compiled "mmap" storage, the 
+        matrix pages are shared via the OS page cache by all the processes using the embeddings
+        """
+        store_path = self._get_store_path(name, "mmap", self.quantization)
+        with open(os.path.join(store_path, "meta.json")) as f_meta:
+            meta = json.load(f_meta)
+        self.vocab_size = meta["vocab_size"]
+        self.embed_size = meta["dim"]
+        if self.vocab_size == 0:
+            raise ValueError('empty embeddings store, compile it again after fixing the embeddings file: ' + store_path)
+        self.matrix = np.memmap(os.path.join(store_path, "vectors.bin"), dtype=meta["dtype"], 
+            mode='r', shape=(self.vocab_size, self.embed_size))
+        if self.quantization == 'int8':
+            self.scales = np.memmap(os.path.join(store_path, "scales.bin"), dtype='<f4', mode='r', shape=(self.vocab_size,))
+        self.env_index_path = os.path.join(store_path, "index")
+
+    def load_embeddings_subset(self, path):
+        """
+        Load a task-specific subset of the embeddings saved by make_embeddings_subset in the 
+        directory path, the full embeddings storage is then not used at all
+        """
+        description = self._get_description(self.name)
+        if description is not None:
+            self.lang = description["lang"]
+        # no newline translation, so that the words containing '\r' stay on their row
+        with open(os.path.join(path, subset_vocab_file), encoding='UTF-8', newline='\n') as f:
+            words = f.read().split('\n')
+        self.matrix = np.load(os.path.join(path, subset_vectors_file), mmap_mode='r')
+        self.vocab_size, self.embed_size = self.matrix.shape
+        self.word_rows = {word: i for i, word in enumerate(words[:self.vocab_size])}
+        print('embeddings subset loaded for', self.vocab_size, "words and", self.embed_size, "dimensions")
+
+    def make_embeddings_subset(self, words, path, top_n=0):
+        """
+        Save in the directory path the vectors of the given words (typically the tokens of a 
+        training corpus), extended with the top_n most frequent words of the embeddings. OOV 
+        words are not saved, they would give zero vectors anyway
+        """
+        vocab = OrderedDict()
+        for word in self.get_top_words(top_n):
+            vocab[word] = None
+        for word in words:
+            if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
+                # the pre-trained embeddings are not cased
+                word = word.lower()
+            if len(word) > 0 and '\n' not in word:
+                vocab[word] = None
+        vocab = list(vocab)
+        vectors = self.get_word_vectors(vocab)
+        known = np.any(vectors != 0, axis=1)
+        vocab = [word for word, kept in zip(vocab, known) if kept]
+        if not os.path.exists(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, subset_vectors_file), vectors[known])
+        # one word per line, the words being written and read back without newline translation
+        with open(os.path.join(path, subset_vocab_file), 'w', encoding='UTF-8', newline='\n') as f:
+            f.write('\n'.join(vocab))
+        print('embeddings subset saved for', len(vocab), "words and", self.static_embed_size, "dimensions")
+
+    def get_store_signature(self):
+        """
+        Storage of the static vectors ("memory", "lmdb", "mmap" or "subset"), data type of the 
+        stored vectors and vocabulary size, which identify with the embeddings name the vectors 
+        given by this object
+        """
+        if self.word_rows is not None:
+            store = "subset"
+        elif self.matrix is not None:
+            store = "mmap"
+        elif self.env_path is not None:
+            store = "lmdb"
+        else:
+            store = "memory"
+        if self.matrix is not None:
+            dtype = self.matrix.dtype
+        elif self.env_path is not None:
+            dtype = _vector_dtypes[_quantizations[self.quantization]]
+        else:
+            dtype = np.dtype('float32')
+        return {"store": store, "dtype": dtype.name, "vocab_size": self.vocab_size}
 
+    def get_top_words(self, top_n):
+        """
+        Generate the top_n first words of the embeddings file, which are the most frequent ones 
+        for the usual pre-trained embeddings (Glove, fastText, word2vec), read from the dictionary 
+        of the fastText .bin files
+        """
+        description = self._get_description(self.name)
+        if top_n <= 0 or description is None:
+            return
+        embeddings_format = description.get("format", "vec")
+        if embeddings_format not in _formats:
+            raise ValueError('unsupported format of embeddings for the most frequent words: ' + str(embeddings_format))
+        embeddings_path = description["path"]
+        if not os.path.isfile(embeddings_path):
+            print("Warning: embeddings file", embeddings_path, "not found, the most frequent words are not added to the subset")
+            return
+        if embeddings_format == "bin":
+            # the dictionary of fastText is sorted by decreasing frequency
+            for word in _read_fasttext_bin_header(embeddings_path)["words"][:top_n]:
+                yield word
+            return
+        hasHeader = description["type"] != "glove"
+        with open(embeddings_path, encoding='UTF-8', errors='ignore') as f:
+            if hasHeader:
+                f.readline()
+            for i, line in enumerate(f):
+                if i >= top_n:
+                    break
+                # the word itself can contain spaces, so it is everything before the vector values
+                yield line.rstrip().rsplit(' ', self.static_embed_size)[0]
 
     def make_embeddings_simple(self, name="fasttext-crawl", hasHeader=True):
+        description = self._get_description(name)
+        if self.quantization is None and description is not None:
+            self.quantization = description.get("quantization")
+        if self.quantization == 'float32':
+            self.quantization = None
+        if self.quantization not in _quantizations:
+            raise ValueError('unsupported quantization of embeddings: ' + str(self.quantization))
         if self.embedding_lmdb_path is None or self.embedding_lmdb_path == "None":
             print("embedding_lmdb_path is not specified in the embeddings registry, so the embeddings will be loaded in memory...")
+            if self.quantization is not None:
+                print("Warning: the quantization applies only to the stored embeddings, the embeddings are loaded in memory as float32")
+                self.quantization = None
             self.make_embeddings_simple_in_memory(name, hasHeader)
+        elif self._get_storage(description) == "mmap":
+            if description is not None:
+                self.lang = description["lang"]
+            if not os.path.isfile(os.path.join(self._get_store_path(name, "mmap", self.quantization), "meta.json")):
+                self.make_embeddings_mmap(name, hasHeader)
+            self.load_embeddings_mmap(name)
         else:    
             # check if the lmdb database exists
-            envFilePath = os.path.join(self.embedding_lmdb_path, name)
+            envFilePath = self._get_store_path(name, "lmdb", self.quantization)
             if os.path.isdir(envFilePath):
                 description = self._get_description(name)
                 if description is not None:
                     self.lang = description["lang"]
 
-                # open the database in read mode
-                self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=4)
+                # the database is used in read mode
+                self.env_path = envFilePath
                 # we need to set self.embed_size and self.vocab_size
                 with self.env.begin() as txn:
                     stats = txn.stat()
@@ -208,22 +648,25 @@ class Embeddings(object):
                 with self.env.begin() as txn:
                     cursor = txn.cursor()
                     for key, value in cursor:
-                        vector = _deserialize_pickle(value)
+                        vector = _deserialize_vector(value)
                         self.embed_size = vector.shape[0]
                         break
                     cursor.close()
-
-                # no idea why, but we need to close and reopen the environment to avoid
-                # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-                # when opening new transaction !
-                self.env.close()
-                self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=2)
             else: 
-                # create and load the database in write mode
-                self.env = lmdb.open(envFilePath, map_size=map_size)
                 self.make_embeddings_lmdb(name, hasHeader)
+                self.env_path = envFilePath
+        if self.ngrams is None and description is not None and description.get("format") == "bin":
+            # fastText .bin embeddings: the char n-grams are stored too, for building OOV vectors
+            if not os.path.isfile(os.path.join(self._get_store_path(name, "ngrams", self.quantization), "meta.json")):
+                self.make_embeddings_ngrams(name)
+            self.load_embeddings_ngrams(name)
 
     def make_ELMo(self):
+        import tensorflow as tf
+        from utilities.bilm.data import Batcher
+        from utilities.bilm.model import BidirectionalLanguageModel
+        from utilities.bilm.elmo import weight_layers
+
         # Location of pretrained BiLM for the specified language
         # TBD check if ELMo language resources are present
         description = self._get_description('elmo-en')
@@ -238,69 +681,165 @@ class Embeddings(object):
             # Create a Batcher to map text to character ids
             self.batcher = Batcher(vocab_file, 50)
 
-            # Build the biLM graph.
-            self.bilm = BidirectionalLanguageModel(options_file, weight_file)
+            # the biLM has its own graph, independent from the Keras one, and is run by one 
+            # session created once and kept open until close()
+            self.elmo_graph = tf.Graph()
+            with self.elmo_graph.as_default():
+                # weird, for this cpu is faster than gpu (1080Ti !)
+                with tf.device("/cpu:0"):
+                    # Build the biLM graph.
+                    self.bilm = BidirectionalLanguageModel(options_file, weight_file)
+
+                    # Input placeholders to the biLM.
+                    self.character_ids = tf.placeholder('int32', shape=(None, None, 50))
+                    self.embeddings_op = self.bilm(self.character_ids)
+                    
+                    with tf.variable_scope('', reuse=tf.AUTO_REUSE):
+                        # the reuse=True scope reuses weights from the whole context 
+                        self.elmo_input = weight_layers('input', self.embeddings_op, l2_coef=0.0)
+
+                    # the LSTMs of the biLM are stateful, their final states being the initial 
+                    # states of the next batch: they are reset to zero before each batch (as when 
+                    # the variables were initialized for each batch), so that the representations of 
+                    # a sentence do not depend on the sentences processed before
+                    lm_graph = self.bilm._graphs[self.character_ids]
+                    init_states = [state for direction in ['forward', 'backward'] 
+                        for layer_states in lm_graph.lstm_init_states[direction] 
+                        for state in layer_states]
+                    self.elmo_reset_states_op = tf.variables_initializer(init_states)
+
+                config = tf.ConfigProto(intra_op_parallelism_threads=self.elmo_intra_op_threads, 
+                                        inter_op_parallelism_threads=self.elmo_inter_op_threads)
+                self.elmo_session = tf.Session(graph=self.elmo_graph, config=config)
+                # It is necessary to initialize variables once before running inference
+                self.elmo_session.run(tf.global_variables_initializer())
 
-            # Input placeholders to the biLM.
-            self.character_ids = tf.placeholder('int32', shape=(None, None, 50))
-            self.embeddings_op = self.bilm(self.character_ids)
-            
-            with tf.variable_scope('', reuse=tf.AUTO_REUSE):
-                # the reuse=True scope reuses weights from the whole context 
-                self.elmo_input = weight_layers('input', self.embeddings_op, l2_coef=0.0)
-            
+    def close(self):
+        """
+        Close the ELMo session, ELMo embeddings cannot be computed anymore with this object
+        """
+        if self._is_ELMo_cache_owner() and len(self.elmo_cache_accessed) > 0:
+            self._update_ELMo_cache({})
+        if self.elmo_session is not None:
+            self.elmo_session.close()
+            self.elmo_session = None
 
-    def dump_ELMo_token_embeddings(self, x_train):
+    def dump_ELMo_token_embeddings(self, x_train=None):
+        """
+            Dump the context-independent ELMo representations (output of the char CNN) of the 
+            vocabulary of the ELMo model or, if given, of the tokens of the training data
+        """
         if not self.use_ELMo:
             print("Warning: ELMo embeddings dump requested but embeddings object wrongly initialised")
             return
 
+        import h5py
+
         description = self._get_description('elmo-en')
         if description is not None:
             print("Building ELMo token dump")
 
-            self.lang = description["lang"]
-            options_file = description["path-config"]
-            weight_file = description["path_weights"]
-            working_path = description["path-dump"]
-
-            all_tokens = set(['<S>', '</S>'])
-            for i in range(0, len(x_train)):
+            vocab_file, token_embedding_file = self._get_ELMo_token_dump_paths(description)
+            if x_train is None:
+                tokens = []
+                with open(description["path-vocab"]) as fin:
+                    for line in fin:
+                        token = line.strip()
+                        if token != '!!!MAXTERMID':
+                            tokens.append(token)
+            else:
                 # as it is training, it is already tokenized
-                tokens = x_train[i]
-                for token in tokens:
-                    if token not in all_tokens:
-                       all_tokens.add(token)
+                tokens = sorted(set(token for sentence in x_train for token in sentence))
+            # the begin/end of sentence tokens are given by the batcher, the unknown token 
+            # identifies the tokens out of the vocabulary
+            special_tokens = ['<S>', '</S>', '<UNK>']
+            tokens = special_tokens + [token for token in tokens if token not in special_tokens]
+
+            embed_dim = int(self.embeddings_op['token_embeddings'].shape[2])
+            embeddings = np.zeros((len(tokens), embed_dim), dtype='float32')
+            # <S> and </S> surrounding an empty sentence
+            local_token_ids = self.batcher.batch_sentences([[]])
+            embeddings[0:2] = self.elmo_session.run(
+                self.embeddings_op['token_embeddings'],
+                feed_dict={self.character_ids: local_token_ids}
+            )[0]
+            for i in tqdm(range(len(special_tokens), len(tokens), 1000)):
+                embeddings[i:i+1000] = self._get_ELMo_char_embeddings(tokens[i:i+1000])
 
-            vocab_file = os.path.join(working_path, 'vocab_small.txt')
             with open(vocab_file, 'w') as fout:
-                fout.write('\n'.join(all_tokens))
-
-            tf.reset_default_graph()
-            token_embedding_file = os.path.join(working_path, 'elmo_token_embeddings.hdf5')
-            dump_token_embeddings(
-                vocab_file, options_file, weight_file, token_embedding_file
-            )
-            tf.reset_default_graph()
-
-            self.batcher_token_dump = TokenBatcher(vocab_file)
-
-            self.bilm_token_dump = BidirectionalLanguageModel(
-                options_file,
-                weight_file,
-                use_character_inputs=False,
-                embedding_weight_file=token_embedding_file
-            )
-
-            self.token_ids = tf.placeholder('int32', shape=(None, None))
-            self.embeddings_op_token_dump = self.bilm_token_dump(self.token_ids)
-            """
-            with tf.variable_scope('', reuse=tf.AUTO_REUSE):
-                # the reuse=True scope reuses weights from the whole context 
-                self.elmo_input_token_dump = weight_layers('input', self.embeddings_op_token_dump, l2_coef=0.0)
-            """
+                fout.write('\n'.join(tokens))
+            with h5py.File(token_embedding_file, 'w') as fout:
+                fout.create_dataset('embedding', embeddings.shape, dtype='float32', data=embeddings)
+                fout.attrs['model'] = self.elmo_model_version
             print("ELMo token dump completed")
 
+    def load_ELMo_token_dump(self):
+        """
+            Load the dumped ELMo token representations, built first if not available for the 
+            current ELMo model
+        """
+        import h5py
+        from utilities.bilm.data import TokenBatcher
+
+        description = self._get_description('elmo-en')
+        vocab_file, token_embedding_file = self._get_ELMo_token_dump_paths(description)
+        model = None
+        if os.path.isfile(token_embedding_file):
+            with h5py.File(token_embedding_file, 'r') as fin:
+                model = fin.attrs.get('model')
+        if model != self.elmo_model_version:
+            self.dump_ELMo_token_embeddings()
+
+        self.batcher_token_dump = TokenBatcher(vocab_file)
+        with h5py.File(token_embedding_file, 'r') as fin:
+            dataset = fin['embedding']
+            # the token ids of the batcher start at 1, 0 being the padding
+            self.elmo_token_embeddings = np.zeros((dataset.shape[0]+1, dataset.shape[1]), dtype='float32')
+            dataset.read_direct(self.elmo_token_embeddings, dest_sel=np.s_[1:])
+        self.elmo_token_unk = self.batcher_token_dump._lm_vocab.unk + 1
+
+    def _get_ELMo_token_dump_paths(self, description):
+        working_path = description["path-dump"]
+        return os.path.join(working_path, 'elmo_token_vocab.txt'), os.path.join(working_path, 'elmo_token_embeddings.hdf5')
+
+    def _get_ELMo_char_embeddings(self, tokens):
+        """
+            Run the char CNN of the biLM for a list of tokens, out of any context
+        """
+        local_token_ids = self.batcher.batch_sentences([[token] for token in tokens])
+        return self.elmo_session.run(
+            self.embeddings_op['token_embeddings'],
+            feed_dict={self.character_ids: local_token_ids}
+        )[:, 1]
+
+    def _run_ELMo(self, token_list):
+        """
+            Run the biLM for a batch of sentences. With the token dump, the representations of 
+            the tokens are fed to the LSTM layers in place of the output of the char CNN, which 
+            is then run only for the tokens out of the dumped vocabulary
+        """
+        local_token_ids = self.batcher.batch_sentences(token_list)
+        feed_dict = {self.character_ids: local_token_ids}
+        if self.elmo_token_embeddings is not None:
+            token_ids = self.batcher_token_dump.batch_sentences(token_list)
+            token_embeddings = self.elmo_token_embeddings[token_ids]
+            oov_positions = []
+            oov_tokens = {}
+            for i in range(0, len(token_list)):
+                for j in range(0, len(token_list[i])):
+                    if token_ids[i][j+1] == self.elmo_token_unk:
+                        oov_positions.append((i, j+1))
+                        oov_tokens[token_list[i][j]] = None
+            if len(oov_tokens) > 0:
+                oov_tokens = dict(zip(oov_tokens, self._get_ELMo_char_embeddings(list(oov_tokens))))
+                for i, j in oov_positions:
+                    token_embeddings[i][j] = oov_tokens[token_list[i][j-1]]
+            feed_dict[self.embeddings_op['token_embeddings']] = token_embeddings
+        self.elmo_session.run(self.elmo_reset_states_op)
+        if self.elmo_cache_layers:
+            # the layers are mixed after caching
+            return self.elmo_session.run(self.embeddings_op['lm_embeddings'], feed_dict=feed_dict)
+        return self.elmo_session.run(self.elmo_input['weighted_op'], feed_dict=feed_dict)
 
     def get_sentence_vector_only_ELMo(self, token_list):
         """
@@ -311,29 +850,59 @@ class Embeddings(object):
             print("Warning: ELMo embeddings requested but embeddings object wrongly initialised")
             return
         
-        # Create batches of data
-        local_token_ids = self.batcher.batch_sentences(token_list)
-        max_size_sentence = local_token_ids[0].shape[0]
-        # check lmdb cache
-        elmo_result = self.get_ELMo_lmdb_vector(token_list, max_size_sentence)
-        if elmo_result is not None:
-            return elmo_result
+        return self.get_ELMo_vectors(token_list)
 
-        with tf.Session() as sess:
-            # weird, for this cpu is faster than gpu (1080Ti !)
-            with tf.device("/cpu:0"):
-                # It is necessary to initialize variables once before running inference
-                sess.run(tf.global_variables_initializer())
-
-                # Compute ELMo representations 
-                elmo_result = sess.run(
-                    self.elmo_input['weighted_op'],
-                    feed_dict={self.character_ids: local_token_ids}
-                )
-                #cache computation
-                self.cache_ELMo_lmdb_vector(token_list, elmo_result)
+    def get_ELMo_vectors(self, token_list):
+        """
+            Return the ELMo embeddings of a batch of sentences, padded to the longest sentence: 
+            the embeddings of the sentences cached in LMDB are reused and the biLM is run only 
+            on the other sentences, then cached
+        """
+        max_size_sentence = max(len(tokens) for tokens in token_list) + 2
+        # check lmdb cache
+        elmo_result, missing = self.get_ELMo_lmdb_vector(token_list, max_size_sentence)
+
+        # Compute ELMo representations of the missing sentences only, by buckets of similar 
+        # lengths so that the biLM does not run on the padding of the short sentences
+        for bucket in _get_length_buckets(token_list, missing):
+            bucket_token_list = [token_list[i] for i in bucket]
+            bucket_result = self._run_ELMo(bucket_token_list)
+            for k, i in enumerate(bucket):
+                length = len(token_list[i])
+                elmo_result[i][..., :length, :] = bucket_result[k][..., :length, :]
+            #cache computation
+            self.cache_ELMo_lmdb_vector(bucket_token_list, bucket_result)
+
+        if self.elmo_cache_layers:
+            elmo_result = self._mix_ELMo_layers(elmo_result, token_list)
         return elmo_result
 
+    def _mix_ELMo_layers(self, layers, token_list):
+        """
+            Weighted sum of the biLM layers of a batch of sentences, of shape (batch, 3, 
+            max_len, 1024), like bilm weight_layers() but in numpy
+        """
+        mask = np.zeros(layers.shape[0:1] + layers.shape[2:3], dtype=np.float32)
+        for i in range(0, len(token_list)):
+            mask[i][:len(token_list[i])] = 1.0
+        broadcast_mask = mask[:, :, None]
+        weights = np.exp(self.elmo_layer_weights + 1.0 / layers.shape[1])
+        weights /= weights.sum()
+        result = np.zeros(layers.shape[0:1] + layers.shape[2:], dtype=np.float32)
+        for k in range(0, layers.shape[1]):
+            layer = layers[:, k]
+            if self.elmo_layer_norm:
+                # layer normalization excluding the padding
+                N = mask.sum() * layer.shape[2]
+                mean = (layer * broadcast_mask).sum() / N
+                variance = (((layer - mean) * broadcast_mask) ** 2).sum() / N
+                layer = (layer - mean) / np.sqrt(variance + 1E-12)
+            result += weights[k] * layer
+        result *= self.elmo_gamma
+        # the padding is left to zero
+        result *= broadcast_mask
+        return result
+
 
     def get_sentence_vector_with_ELMo(self, token_list):
         """
@@ -367,29 +936,8 @@ class Embeddings(object):
                 max_size_sentence = local_length
         """
 
-        # Create batches of data
-        local_token_ids = self.batcher.batch_sentences(token_list)
-        max_size_sentence = local_token_ids[0].shape[0]
-        # check lmdb cache
-        elmo_result = self.get_ELMo_lmdb_vector(token_list, max_size_sentence)
-        if elmo_result is None:
-            with tf.Session() as sess:
-                # weird, for this cpu is faster than gpu (1080Ti !)
-                with tf.device("/cpu:0"):
-                    # It is necessary to initialize variables once before running inference
-                    sess.run(tf.global_variables_initializer())
-
-                    # Compute ELMo representations 
-                    elmo_result = sess.run(
-                        self.elmo_input['weighted_op'],
-                        feed_dict={self.character_ids: local_token_ids}
-                    )
-                    elmo_result = sess.run(
-                        self.elmo_input['weighted_op'],
-                        feed_dict={self.character_ids: local_token_ids}
-                    )
-                    #cache computation
-                    self.cache_ELMo_lmdb_vector(token_list, elmo_result)
+        elmo_result = self.get_ELMo_vectors(token_list)
+        max_size_sentence = elmo_result.shape[1] + 2
         concatenated_result = np.zeros((elmo_result.shape[0], max_size_sentence-2, self.embed_size), dtype=np.float32)
         for i in range(0, elmo_result.shape[0]):
             for j in range(0, len(token_list[i])):
@@ -402,30 +950,36 @@ class Embeddings(object):
 
 
     def get_sentence_vector_ELMo_with_token_dump(self, token_list):
+        """
+            Return the ELMo embeddings only for a full sentence, computed with the token dump
+        """
         if not self.use_ELMo:
             print("Warning: ELMo embeddings requested but embeddings object wrongly initialised")
             return
-        
-        with tf.variable_scope('', reuse=tf.AUTO_REUSE):
-            # the reuse=True scope reuses weights from the whole context 
-            self.elmo_input_token_dump = weight_layers('input', self.embeddings_op_token_dump, l2_coef=0.0)
-        
-        # Create batches of data
-        local_token_ids = self.batcher_token_dump.batch_sentences(token_list)
 
-        with tf.Session() as sess:
-            # weird, for this cpu is faster than gpu (1080Ti !)
-            with tf.device("/cpu:0"):
-                # It is necessary to initialize variables once before running inference
-                sess.run(tf.global_variables_initializer())
+        if self.elmo_token_embeddings is None:
+            self.load_ELMo_token_dump()
+        return self.get_ELMo_vectors(token_list)
 
-                # Compute ELMo representations 
-                elmo_result = sess.run(
-                    self.elmo_input_token_dump['weighted_op'],
-                    feed_dict={self.token_ids: local_token_ids}
-                )
-        return elmo_result
 
+    def _get_storage(self, description):
+        """
+        Storage backend of a registered embeddings, given by its "storage" field: "lmdb" 
+        (default, one entry per word) or "mmap" (one contiguous memory-mapped matrix)
+        """
+        if description is not None and "storage" in description:
+            return description["storage"]
+        return "lmdb"
+
+    def _get_store_path(self, name, storage="lmdb", quantization=None):
+        store_name = name
+        if quantization is not None:
+            store_name += "." + quantization
+        if storage == "mmap":
+            store_name += ".mmap"
+        elif storage == "ngrams":
+            store_name += ".ngrams"
+        return os.path.join(self.embedding_lmdb_path, store_name)
 
     def _get_description(self, name):
         for emb in self.registry["embeddings"]:
@@ -444,95 +998,341 @@ class Embeddings(object):
         if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
             # the pre-trained embeddings are not cased
             word = word.lower()
-        if self.env is None:
+        if self.matrix is None and self.env is None:
             # db not available, the embeddings should be available in memory (normally!)
             return self.get_word_vector_in_memory(word)
-        try:    
-            with self.env.begin() as txn:
-                txn = self.env.begin()   
-                vector = txn.get(word.encode(encoding='UTF-8'))
+        if self.cache is not None:
+            word_vector = self.cache.get(word)
+            if word_vector is not None:
+                return word_vector
+        if self.matrix is not None:
+            word_vector = self.get_word_vector_mmap(word)
+        else:
+            word_vector = self.get_word_vector_lmdb(word)
+        if word_vector is self.zero_vector:
+            word_vector = self.get_oov_vector(word)
+        if self.cache is not None:
+            self.cache.put(word, word_vector)
+        return word_vector
+
+    def get_word_vector_lmdb(self, word):
+        with self.env.begin() as txn:
+            vector = txn.get(word.encode(encoding='UTF-8'))
+            if vector:
+                word_vector = _deserialize_vector(vector)
+                vector = None
+            else:
+                word_vector = self.zero_vector
+                # alternatively, initialize with random negative values
+                #word_vector = np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
+        return word_vector
+
+    def cache_stats(self):
+        """
+            Hit, miss and eviction counters of the static vector cache (None if no cache is used)
+        """
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def get_oov_vector(self, word):
+        """
+            Get the vector of an OOV token, built like in fastText as the average of the vectors 
+            of its char n-grams when available (fastText .bin embeddings), a zero vector otherwise
+        """
+        if self.ngrams is None:
+            return self.zero_vector
+        word_vector = self.oov_cache.get(word)
+        if word_vector is None:
+            hashes = _fasttext_ngram_hashes(word, self.minn, self.maxn, self.bucket)
+            if len(hashes) == 0:
+                word_vector = self.zero_vector
+            else:
+                word_vector = _get_float32_rows(self.ngrams, self.ngram_scales, hashes).mean(axis=0)
+            self.oov_cache.put(word, word_vector)
+        return word_vector
+
+    def get_word_vector_mmap(self, word):
+        """
+            Get static embeddings for a given token from the memory-mapped matrix
+        """
+        row = self._get_rows([word])[0]
+        if row is None:
+            return self.zero_vector
+        return self._get_matrix_rows(row)
+
+    def _get_rows(self, words):
+        """
+            Get the row of each given word in the memory-mapped matrix, None for OOV words
+        """
+        if self.word_rows is not None:
+            return [self.word_rows.get(word) for word in words]
+        rows = []
+        with self.env_index.begin() as txn:
+            for word in words:
+                row = txn.get(word.encode(encoding='UTF-8'))
+                rows.append(None if row is None else _row_index.unpack(row)[0])
+        return rows
+
+    def _get_matrix_rows(self, rows):
+        """
+            Get float32 vectors from the memory-mapped matrix, dequantized if necessary
+        """
+        return _get_float32_rows(self.matrix, self.scales, rows)
+
+    def get_word_vectors(self, tokens, maxlen=None, out=None):
+        """
+            Get static embeddings for a batch of tokens. Given a list of tokens, return a float32 
+            matrix of shape (nb tokens, dim). Given a list of sentences (list of list of tokens), 
+            return a float32 tensor of shape (nb sentences, maxlen, dim), sentences being truncated 
+            to maxlen tokens and padded with zero vectors (maxlen defaults to the longest sentence). 
+            The vectors are written in out if given, a zero float32 array of the same shape
+        """
+        if len(tokens) > 0 and not isinstance(tokens[0], str):
+            if maxlen is None:
+                maxlen = max(len(sentence) for sentence in tokens)
+            result = out
+            if result is None:
+                result = np.zeros((len(tokens), maxlen, self.static_embed_size), dtype=np.float32)
+            flat_result = result.reshape((len(tokens) * maxlen, self.static_embed_size))
+            words = []
+            positions = []
+            for i, sentence in enumerate(tokens):
+                window = sentence[:maxlen]
+                words.extend(window)
+                positions.extend(range(i * maxlen, i * maxlen + len(window)))
+            self._fill_word_vectors(words, positions, flat_result)
+            return result
+
+        result = out
+        if result is None:
+            result = np.zeros((len(tokens), self.static_embed_size), dtype=np.float32)
+        self._fill_word_vectors(tokens, range(len(tokens)), result)
+        return result
+
+    def _fill_word_vectors(self, words, positions, result):
+        """
+            Write in the rows positions of result the vectors of the given words, OOV rows being 
+            left untouched (so zero). Each distinct word is looked-up once, in key order and with a 
+            single read transaction
+        """
+        word_positions = {}
+        for word, position in zip(words, positions):
+            if (self.name == 'wiki.fr') or (self.name == 'wiki.fr.bin'):
+                # the pre-trained embeddings are not cased
+                word = word.lower()
+            if word in word_positions:
+                word_positions[word].append(position)
+            else:
+                word_positions[word] = [position]
+
+        oov_words = []
+        if self.matrix is None and self.env is None:
+            # db not available, the embeddings should be available in memory (normally!)
+            for word, local_positions in word_positions.items():
+                if word in self.model:
+                    result[local_positions] = self.model[word]
+                else:
+                    oov_words.append(word)
+            self._fill_oov_vectors(oov_words, word_positions, result)
+            return
+
+        if self.cache is not None:
+            for word in list(word_positions):
+                word_vector = self.cache.get(word)
+                if word_vector is not None:
+                    result[word_positions.pop(word)] = word_vector
+
+        keys = sorted((word.encode(encoding='UTF-8'), word) for word in word_positions)
+        if self.matrix is not None:
+            rows = []
+            row_words = []
+            sorted_words = [word for key, word in keys]
+            for word, row in zip(sorted_words, self._get_rows(sorted_words)):
+                if row is not None:
+                    rows.append(row)
+                    row_words.append(word)
+                else:
+                    oov_words.append(word)
+            # gather the rows in increasing order to favour sequential page access
+            rows = np.asarray(rows, dtype=np.int64)
+            order = np.argsort(rows)
+            vectors = self._get_matrix_rows(rows[order])
+            for k, o in enumerate(order):
+                result[word_positions[row_words[o]]] = vectors[k]
+                if self.cache is not None:
+                    self.cache.put(row_words[o], vectors[k].copy())
+            self._fill_oov_vectors(oov_words, word_positions, result)
+            return
+
+        # values are decoded without copy from the memory map, so only valid within the transaction
+        with self.env.begin(buffers=True) as txn:
+            for key, word in keys:
+                vector = txn.get(key)
                 if vector:
-                    word_vector = _deserialize_pickle(vector)
-                    vector = None
+                    word_vector = _deserialize_vector(vector)
+                    result[word_positions[word]] = word_vector
+                    if self.cache is not None:
+                        self.cache.put(word, word_vector.copy())
                 else:
-                    word_vector = np.zeros((self.static_embed_size,), dtype=np.float32)
-                    # alternatively, initialize with random negative values
-                    #word_vector = np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
-                    # alternatively use fasttext OOV ngram possibilities (if ngram available)
-        except lmdb.Error:
-            # no idea why, but we need to close and reopen the environment to avoid
-            # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-            # when opening new transaction !
-            self.env.close()
-            envFilePath = os.path.join(self.embedding_lmdb_path, self.name)
-            self.env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=2, lock=False)
-            return self.get_word_vector(word)
-        return word_vector
+                    oov_words.append(word)
+        self._fill_oov_vectors(oov_words, word_positions, result)
+
+    def _fill_oov_vectors(self, oov_words, word_positions, result):
+        """
+            Write the vectors of OOV words, built from their char n-grams when available (zero 
+            vectors otherwise, so the rows are left untouched)
+        """
+        for word in oov_words:
+            word_vector = self.get_oov_vector(word)
+            if word_vector is not self.zero_vector:
+                result[word_positions[word]] = word_vector
+            if self.cache is not None:
+                self.cache.put(word, word_vector)
 
-    
     def get_ELMo_lmdb_vector(self, token_list, max_size_sentence):
         """
-            Try to get the ELMo embeddings for a sequence cached in LMDB
+            Try to get the ELMo embeddings for a sequence cached in LMDB. Return the embeddings 
+            of the cached sentences (zero for the others) and the indices of the sentences 
+            not cached
         """
-        if self.env_ELMo is None:
-            # db cache not available, we don't cache ELMo stuff
-            return None
-        try:    
+        if self.elmo_cache_layers:
+            ELMo_vector = np.zeros((len(token_list), ELMo_nb_layers, max_size_sentence-2, ELMo_embed_size), dtype='float32')
+        else:
             ELMo_vector = np.zeros((len(token_list), max_size_sentence-2, ELMo_embed_size), dtype='float32')
-            with self.env_ELMo.begin() as txn:
-                for i in range(0, len(token_list)):
-                    txn = self.env_ELMo.begin()
-                    # get a hash for the token_list
-                    the_hash = list_digest(token_list[i])
-                    vector = txn.get(the_hash.encode(encoding='UTF-8'))
-                    if vector:
-                        # adapt expected shape/padding
-                        local_embeddings = _deserialize_pickle(vector)
-                        if local_embeddings.shape[0] > max_size_sentence-2:
-                            # squeeze the extra padding space
-                            ELMo_vector[i] = local_embeddings[:max_size_sentence-2,]
-                        elif local_embeddings.shape[0] == max_size_sentence-2:
-                            # bingo~!
-                            ELMo_vector[i] = local_embeddings
-                        else:
-                            # fill the missing space with padding
-                            filler = np.zeros((max_size_sentence-(local_embeddings.shape[0]+2), ELMo_embed_size), dtype='float32')
-                            ELMo_vector[i] = np.concatenate((local_embeddings, filler))
-                        vector = None
-                    else:
-                        return None
-        except lmdb.Error:
-            # no idea why, but we need to close and reopen the environment to avoid
-            # mdb_txn_begin: MDB_BAD_RSLOT: Invalid reuse of reader locktable slot
-            # when opening new transaction !
-            self.env_ELMo.close()
-            self.env_ELMo = lmdb.open(embedding_ELMo_cache, readonly=True, max_readers=2048, max_spare_txns=2, lock=False)
-            return self.get_ELMo_lmdb_vector(token_list)
-        return ELMo_vector
-
+        if self.env_ELMo_path is None:
+            # db cache not available, we don't cache ELMo stuff
+            return ELMo_vector, list(range(len(token_list)))
+        cache = self._get_ELMo_cache()
+        if cache is None:
+            # cache not created yet or cleaned by the owner process
+            return ELMo_vector, list(range(len(token_list)))
+        missing = []
+        env, vectors_db, _, _, _ = cache
+        owner = self._is_ELMo_cache_owner()
+        with env.begin(db=vectors_db) as txn:
+            for i in range(0, len(token_list)):
+                key = self._get_ELMo_cache_key(token_list[i])
+                vector = txn.get(key)
+                if vector:
+                    # adapt expected shape/padding, the cached vectors are not padded
+                    local_embeddings = _deserialize_vector(vector)
+                    length = min(local_embeddings.shape[-2], max_size_sentence-2)
+                    ELMo_vector[i][..., :length, :] = local_embeddings[..., :length, :]
+                    if owner:
+                        self.elmo_cache_accessed.add(key)
+                    vector = None
+                else:
+                    missing.append(i)
+        if len(self.elmo_cache_accessed) >= 1000:
+            # the access ticks are updated by batch, to keep the lookups read-only
+            self._update_ELMo_cache({})
+        return ELMo_vector, missing
 
     def cache_ELMo_lmdb_vector(self, token_list, ELMo_vector):
         """
             Cache in LMDB the ELMo embeddings for a given sequence 
         """
-        if self.env_ELMo is None:
-            # db cache not available, we don't cache ELMo stuff
+        if not self._is_ELMo_cache_owner():
+            # db cache not available or read-only in this process, we don't cache ELMo stuff
             return None
-        txn = self.env_ELMo.begin(write=True)
+        entries = {}
         for i in range(0, len(token_list)):
-            # get a hash for the token_list
-            the_hash = list_digest(token_list[i])
-            txn.put(the_hash.encode(encoding='UTF-8'), _serialize_pickle(ELMo_vector[i]))  
-        txn.commit()
+            # the padding is not stored
+            entries[self._get_ELMo_cache_key(token_list[i])] = _serialize_vector(
+                ELMo_vector[i][..., :len(token_list[i]), :], self.elmo_cache_quantization)
+        self._update_ELMo_cache(entries)
+
+    def _get_ELMo_cache_key(self, tokens):
+        # get a hash for the token list, prefixed by the version of the ELMo model and by the 
+        # kind of cached vectors (mixed or per layer)
+        version = self.elmo_model_version
+        if self.elmo_cache_layers:
+            version += 'layers'
+        return (version + list_digest(tokens)).encode(encoding='UTF-8')
+
+    def _get_ELMo_cache(self):
+        """
+            Get the environment of the ELMo cache and its databases: the cached vectors, the 
+            access tick of each cached vector, the cached vector of each access tick (so in 
+            least recently used order) and the counters of the cache. The owner process creates 
+            the databases and drops the vectors of the former cache format, the other processes 
+            get None if the cache does not exist
+        """
+        owner = self._is_ELMo_cache_owner()
+        try:
+            env = self.env_ELMo
+            if self.elmo_cache_dbs is None or self.elmo_cache_dbs[0] is not env:
+                # the databases are opened again with the environment after a fork
+                self.elmo_cache_dbs = (env,) + tuple(env.open_db(name, create=owner) for name in _ELMo_cache_dbs)
+                if owner:
+                    _drop_former_ELMo_cache_entries(env)
+        except lmdb.Error:
+            if owner:
+                raise
+            return None
+        return self.elmo_cache_dbs
+
+    def _update_ELMo_cache(self, entries):
+        """
+            In a single write transaction, store the given serialized ELMo vectors, update the 
+            access ticks of the vectors read since the last update and evict the least recently 
+            used vectors if the cache is above its size limit
+        """
+        env, vectors_db, access_db, lru_db, counters_db = self._get_ELMo_cache()
+        accessed = self.elmo_cache_accessed
+        self.elmo_cache_accessed = set()
+        with env.begin(write=True) as txn:
+            tick = txn.get(b'tick', db=counters_db)
+            tick = 0 if tick is None else _uint64.unpack(tick)[0]
+            size = txn.get(b'size', db=counters_db)
+            size = 0 if size is None else _uint64.unpack(size)[0]
+
+            for key, value in entries.items():
+                previous = txn.get(key, db=vectors_db)
+                if previous is not None:
+                    size -= len(previous)
+                txn.put(key, value, db=vectors_db)
+                size += len(value)
+
+            for key in accessed.union(entries):
+                previous_tick = txn.get(key, db=access_db)
+                if previous_tick is not None:
+                    txn.delete(previous_tick, db=lru_db)
+                elif key not in entries:
+                    # evicted since it was read
+                    continue
+                tick += 1
+                txn.put(key, _uint64.pack(tick), db=access_db)
+                txn.put(_uint64.pack(tick), key, db=lru_db)
+
+            if self.elmo_cache_max_bytes > 0 and size > self.elmo_cache_max_bytes:
+                # eviction down to 90% of the limit, so that it does not take place at each update
+                cursor = txn.cursor(db=lru_db)
+                while size > 0.9 * self.elmo_cache_max_bytes and cursor.first():
+                    key = cursor.value()
+                    value = txn.get(key, db=vectors_db)
+                    if value is not None:
+                        size -= len(value)
+                        txn.delete(key, db=vectors_db)
+                    txn.delete(key, db=access_db)
+                    cursor.delete()
+
+            txn.put(b'tick', _uint64.pack(tick), db=counters_db)
+            txn.put(b'size', _uint64.pack(max(size, 0)), db=counters_db)
 
     def clean_ELMo_cache(self):
         """
-            Delete ELMo embeddings cache, this takes place normally after the completion of a training
+            Delete ELMo embeddings cache, the cache is otherwise persistent and bounded in size
         """
-        if self.env_ELMo is None:
-            # db cache not available, nothing to clean
+        if not self._is_ELMo_cache_owner() or not os.path.isdir(self.embedding_ELMo_cache):
+            # db cache not available or read-only in this process, nothing to clean
             return
         else: 
+            # the environment is reopened (empty) at the next access
+            self.elmo_cache_dbs = None
+            self.elmo_cache_accessed = set()
+            _close_env(self.embedding_ELMo_cache)
             for file in os.listdir(self.embedding_ELMo_cache): 
                 file_path = os.path.join(self.embedding_ELMo_cache, file)
                 if os.path.isfile(file_path):
@@ -546,11 +1346,72 @@ class Embeddings(object):
         if word in self.model:
             return self.model[word]
         else:
-            # for unknown word, we use a vector filled with 0.0
-            return np.zeros((self.static_embed_size,), dtype=np.float32)
+            # for unknown word, we use the fastText char n-grams if available, otherwise 
+            # a vector filled with 0.0
+            return self.get_oov_vector(word)
             # alternatively, initialize with random negative values
             #return np.random.uniform(low=-0.5, high=0.0, size=(self.embed_size,))
-            # alternatively use fasttext OOV ngram possibilities (if ngram available)
+
+class VectorCache(object):
+    """
+    Bounded LRU cache of word vectors, limited in number of entries and/or in bytes (a limit 
+    of 0 means no limit for this criteria), keeping hit, miss and eviction counters. The 
+    cached vectors are made read-only. 
+    """
+    def __init__(self, max_entries=0, max_bytes=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return vector
+
+    def put(self, key, vector):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            # the cached vectors are shared by all the lookups, so they must not be modified
+            vector.flags.writeable = False
+            self.entries[key] = vector
+            self.nbytes += vector.nbytes
+            while len(self.entries) > 1 and \
+                ((self.max_entries > 0 and len(self.entries) > self.max_entries) or 
+                 (self.max_bytes > 0 and self.nbytes > self.max_bytes)):
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "miss_rate": self.misses / lookups if lookups > 0 else 0.0
+            }
+
 
 def _serialize_byteio(array):
     memfile = io.BytesIO()
@@ -570,6 +1431,321 @@ def _serialize_pickle(a):
 def _deserialize_pickle(serialized):
     return pickle.loads(serialized)
 
+def _quantize(vectors, quantization=None):
+    """
+    Convert float vectors (last axis) to the stored data type, return the data and, for int8, 
+    the float32 scale of each vector
+    """
+    if quantization == 'int8':
+        flat = np.asarray(vectors, dtype=np.float32).reshape((-1, vectors.shape[-1]))
+        scales = np.abs(flat).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.round(flat / scales[:, None]).astype(np.int8).reshape(vectors.shape)
+        return data, scales.astype('<f4')
+    return np.ascontiguousarray(vectors, dtype=_vector_dtypes[_quantizations[quantization]]), None
+
+def _close_at_exit(embeddings_ref):
+    embeddings = embeddings_ref()
+    if embeddings is not None:
+        embeddings.close()
+
+def _get_env(path, readonly=True):
+    """
+    Get the LMDB environment of the current process for a given path, opened at the first 
+    access. An LMDB environment must not be used across a fork and can be opened only once per 
+    process, so an environment inherited from the parent process is closed in the child process 
+    and replaced by a new one. The environments do not keep spare read transactions: the reader 
+    slot of a spare transaction would be released by the close in the child while still used 
+    by the parent. For the same reason, the process must not fork while another of its threads 
+    is in the middle of a transaction (the workers of the Keras data generators are forked 
+    while the parent process does not access the embeddings). 
+    """
+    pid = os.getpid()
+    entry = _envs.get(path)
+    if entry is not None and entry[0] == pid:
+        return entry[1]
+    with _envs_lock:
+        entry = _envs.get(path)
+        if entry is not None:
+            if entry[0] == pid:
+                return entry[1]
+            entry[1].close()
+        if readonly:
+            env = lmdb.open(path, readonly=True, max_readers=2048, max_spare_txns=0, max_dbs=4)
+        else:
+            env = lmdb.open(path, map_size=map_size, max_spare_txns=0, max_dbs=4)
+        _envs[path] = (pid, env)
+    return env
+
+def _drop_former_ELMo_cache_entries(env):
+    """
+    Delete the vectors of the former format of the ELMo cache, pickled in the main database 
+    without the version of the ELMo model in their keys, so not reusable. They would otherwise 
+    be neither counted in the size of the cache nor evicted. 
+    """
+    with env.begin() as txn:
+        former_keys = [key for key in txn.cursor().iternext(values=False) if key not in _ELMo_cache_dbs]
+    if len(former_keys) > 0:
+        with env.begin(write=True) as txn:
+            for key in former_keys:
+                txn.delete(key)
+
+def _close_env(path):
+    """
+    Close the LMDB environment of the current process for a given path, if opened
+    """
+    with _envs_lock:
+        entry = _envs.pop(path, None)
+        if entry is not None:
+            entry[1].close()
+
+def _get_float32_rows(matrix, scales, rows):
+    """
+    Get rows of a stored matrix as float32 vectors, dequantized if necessary
+    """
+    vectors = matrix[rows]
+    if matrix.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[rows][..., None]
+    return vectors
+
+def _serialize_vector(a, quantization=None):
+    """
+    Serialize a float array as raw little-endian data preceded by a small header, quantized 
+    as float16 or as int8 with a scale per vector if requested
+    """
+    a = np.asarray(a)
+    data, scales = _quantize(a, quantization)
+    header = _vector_header.pack(_vector_magic, _quantizations[quantization], data.ndim)
+    header += struct.pack('<%dI' % data.ndim, *data.shape)
+    if scales is not None:
+        header += scales.tobytes()
+    return header + data.tobytes()
+
+def _deserialize_vector(serialized):
+    """
+    Decode a value written by _serialize_vector() as float32 array, without copy when 
+    serialized is a buffer and the vector is not quantized. Values pickled by former versions 
+    of DeLFT are still supported. 
+    """
+    if bytes(serialized[:2]) != _vector_magic:
+        return _deserialize_pickle(bytes(serialized))
+    _, dtype_code, ndim = _vector_header.unpack_from(serialized)
+    shape = struct.unpack_from('<%dI' % ndim, serialized, _vector_header.size)
+    offset = _vector_header.size + 4 * ndim
+    scales = None
+    if _vector_dtypes[dtype_code] == np.int8:
+        nb_vectors = int(np.prod(shape[:-1]))
+        scales = np.frombuffer(serialized, dtype='<f4', count=nb_vectors, offset=offset)
+        offset += 4 * nb_vectors
+    vector = np.frombuffer(serialized, dtype=_vector_dtypes[dtype_code], count=int(np.prod(shape)), offset=offset)
+    if dtype_code == 0:
+        return vector.reshape(shape)
+    # dequantization
+    vector = vector.astype(np.float32)
+    if scales is not None:
+        vector = vector.reshape((-1, shape[-1])) * scales[:, None]
+    return vector.reshape(shape)
+
+def migrate_lmdb_embeddings(envFilePath, batch_size=100000):
+    """
+    Convert in place an embeddings LMDB database with pickled vectors into the raw vector 
+    format, without re-parsing the original embeddings file
+    """
+    tmpFilePath = envFilePath + ".migrating"
+    oldFilePath = envFilePath + ".old"
+    env = lmdb.open(envFilePath, readonly=True, max_readers=2048, max_spare_txns=2)
+    env_out = lmdb.open(tmpFilePath, map_size=map_size)
+    nb_converted = 0
+    with env.begin(buffers=True) as txn:
+        nb_entries = txn.stat()['entries']
+        txn_out = env_out.begin(write=True)
+        for i, (key, value) in enumerate(tqdm(txn.cursor(), total=nb_entries)):
+            if bytes(value[:2]) != _vector_magic:
+                value = _serialize_vector(_deserialize_pickle(bytes(value)))
+                nb_converted += 1
+            txn_out.put(bytes(key), value)
+            if (i+1) % batch_size == 0:
+                txn_out.commit()
+                txn_out = env_out.begin(write=True)
+        txn_out.commit()
+    env.close()
+    env_out.close()
+
+    # swap the databases, the former one being removed only when the new one is in place
+    os.rename(envFilePath, oldFilePath)
+    os.rename(tmpFilePath, envFilePath)
+    shutil.rmtree(oldFilePath)
+    print(nb_converted, "vectors converted out of", nb_entries)
+
+def _split_file(file_path, start, chunk_size):
+    """
+    Split a text file, from byte offset start, into byte ranges of around chunk_size bytes, 
+    each range ending at a line boundary
+    """
+    file_size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as f:
+        while start < file_size:
+            end = min(start + chunk_size, file_size)
+            if end < file_size:
+                f.seek(end)
+                # move to the end of the current line
+                end += len(f.readline())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _count_vector_values(tokens):
+    """
+    Count the numerical values at the end of the space-separated tokens of an embeddings line, 
+    the first token being always part of the word
+    """
+    nb_values = 0
+    for token in reversed(tokens[1:]):
+        try:
+            float(token)
+        except ValueError:
+            break
+        nb_values += 1
+    return nb_values
+
+def _parse_embeddings_chunk(chunk):
+    """
+    Parse the lines "word v1 v2 ... vn" of a byte range of an embeddings file, the numerical 
+    values of the whole range being parsed at once by numpy
+    """
+    file_path, start, end, dim = chunk
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start).decode('UTF-8')
+
+    words = []
+    values = []
+    for line in data.split('\n'):
+        line = line.rstrip()
+        word, _, vector = line.partition(' ')
+        if len(word) == 0 or vector.count(' ') != dim - 1:
+            # token containing spaces (seen for instance in glove-840B) or malformed line
+            pieces = line.rsplit(' ', dim)
+            if len(pieces) != dim + 1 or len(pieces[0]) == 0:
+                continue
+            word = pieces[0]
+            vector = line[len(word)+1:]
+        words.append(word)
+        values.append(vector)
+
+    try:
+        vectors = np.fromstring(' '.join(values), dtype=np.float32, sep=' ')
+    except ValueError:
+        vectors = None
+    if vectors is None or vectors.shape[0] != len(words) * dim:
+        # at least one non numerical value, so we fall back to a line by line parsing
+        parsed_words = []
+        parsed_vectors = []
+        for word, vector in zip(words, values):
+            try:
+                parsed_vectors.append(np.array(vector.split(' '), dtype=np.float32))
+                parsed_words.append(word)
+            except ValueError:
+                continue
+        words = parsed_words
+        vectors = np.array(parsed_vectors, dtype=np.float32)
+    return words, vectors.reshape((len(words), dim)), end - start
+
+def _read_fasttext_bin_header(file_path):
+    """
+    Read the parameters and the dictionary of a fastText .bin file (both the current format 
+    and the former one without magic number), and the position of its input matrix, which 
+    stores the vectors of the words followed by the vectors of the char n-gram buckets
+    """
+    with open(file_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version = struct.unpack_from('<2i', data, 0)
+        new_format = (magic == _fasttext_magic)
+        if new_format:
+            dim, _, _, _, _, _, _, _, bucket, minn, maxn, _ = struct.unpack_from('<12i', data, 8)
+            pos = 8 + 48 + 8
+        else:
+            dim = magic
+            _, _, _, _, _, _, bucket, minn, maxn, _ = struct.unpack_from('<10i', data, 8)
+            pos = 8 + 40 + 8
+        size, nb_words, nb_labels = struct.unpack_from('<3i', data, pos)
+        pos += 12 + 8
+        if new_format:
+            pruneidx_size, = struct.unpack_from('<q', data, pos)
+            pos += 8
+        words = []
+        for i in range(size):
+            # null terminated word, followed by its count (int64) and its type (int8, 0 for words)
+            end = data.find(b'\x00', pos)
+            if i < nb_words:
+                words.append(data[pos:end].decode('UTF-8', errors='replace'))
+            pos = end + 1 + 9
+        if new_format:
+            if pruneidx_size > 0:
+                raise ValueError('pruned fastText models are not supported: ' + file_path)
+            quant_input = data[pos]
+            pos += 1
+            if quant_input:
+                raise ValueError('quantized fastText models are not supported: ' + file_path)
+        nb_rows, nb_cols = struct.unpack_from('<2q', data, pos)
+        pos += 16
+    finally:
+        data.close()
+    if bucket == 0 or maxn == 0:
+        maxn = 0
+    return {"dim": nb_cols, "words": words, "nb_words": nb_words, "nb_rows": nb_rows, 
+        "matrix_offset": pos, "bucket": bucket, "minn": minn, "maxn": maxn}
+
+def _fasttext_ngram_hashes(word, minn, maxn, bucket):
+    """
+    Bucket of each char n-gram of a word as computed by fastText: n-grams of minn to maxn UTF-8 
+    characters of "<word>", hashed with the 32 bits FNV-1a function over the bytes taken as 
+    signed char (so sign-extended above 127)
+    """
+    if word == '</s>' or maxn == 0:
+        return []
+    data = ('<' + word + '>').encode('UTF-8')
+    size = len(data)
+    hashes = []
+    for i in range(size):
+        if (data[i] & 0xC0) == 0x80:
+            # not the first byte of a UTF-8 character
+            continue
+        # the hash is updated incrementally for the n-grams starting at i
+        h = 2166136261
+        j = i
+        n = 1
+        while j < size and n <= maxn:
+            h = ((h ^ (data[j] if data[j] < 128 else data[j] | 0xFFFFFF00)) * 16777619) & 0xFFFFFFFF
+            j += 1
+            while j < size and (data[j] & 0xC0) == 0x80:
+                h = ((h ^ (data[j] | 0xFFFFFF00)) * 16777619) & 0xFFFFFFFF
+                j += 1
+            if n >= minn and not (n == 1 and (i == 0 or j == size)):
+                hashes.append(h % bucket)
+            n += 1
+    return hashes
+
+def _fasttext_bin_word_vectors(chunk):
+    """
+    Compute the vectors of consecutive words of a fastText .bin file, as the average of the 
+    input vectors of the word and of its char n-grams
+    """
+    file_path, header, start, words = chunk
+    input_matrix = np.memmap(file_path, dtype='<f4', mode='r', offset=header["matrix_offset"], 
+        shape=(header["nb_rows"], header["dim"]))
+    vectors = np.zeros((len(words), header["dim"]), dtype=np.float32)
+    for k, word in enumerate(words):
+        rows = [start + k]
+        rows.extend(header["nb_words"] + h 
+            for h in _fasttext_ngram_hashes(word, header["minn"], header["maxn"], header["bucket"]))
+        vectors[k] = input_matrix[rows].mean(axis=0)
+    return words, vectors
+
 def _get_num_lines(file_path):
     fp = open(file_path, "r+")
     buf = mmap.mmap(fp.fileno(), 0)
@@ -578,6 +1754,41 @@ def _get_num_lines(file_path):
         lines += 1
     return lines
 
+def _ELMo_model_digest(options_file, weight_file):
+    """
+    Short digest identifying an ELMo model, from its options file and from the size, the 
+    beginning and the end of its weight file (hashing the whole weight file would take seconds)
+    """
+    digest = hashlib.sha1()
+    with open(options_file, 'rb') as f:
+        digest.update(f.read())
+    size = os.path.getsize(weight_file)
+    digest.update(struct.pack('<Q', size))
+    with open(weight_file, 'rb') as f:
+        digest.update(f.read(1024 * 1024))
+        f.seek(max(0, size - 1024 * 1024))
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def _get_length_buckets(token_list, indices):
+    """
+    Group the given indices of sentences into buckets of similar sentence lengths
+    """
+    buckets = []
+    bucket = []
+    min_length = 0
+    for i in sorted(indices, key=lambda i: len(token_list[i])):
+        length = len(token_list[i])
+        if len(bucket) > 0 and length > max(min_length * ELMo_bucket_ratio, min_length + ELMo_bucket_min_width):
+            buckets.append(bucket)
+            bucket = []
+        if len(bucket) == 0:
+            min_length = length
+        bucket.append(i)
+    if len(bucket) > 0:
+        buckets.append(bucket)
+    return buckets
+
 def list_digest(strings):
     hash = hashlib.sha1()
     for s in strings:
@@ -606,4 +1817,26 @@ def test():
     embeddings.cache_ELMo_lmdb_vector(token_list, vect)
     vect = embeddings.get_sentence_vector_ELMo(token_list)
 
-    embeddings.clean_ELMo_cache()
\ No newline at end of file
+    embeddings.clean_ELMo_cache()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Management of the pre-trained embeddings")
+
+    parser.add_argument("action", help="one of [migrate]")
+    parser.add_argument("--embedding", required=True, help="name of the embeddings as in the embeddings registry")
+    parser.add_argument("--registry", default='./embedding-registry.json', help="path to the embeddings registry")
+
+    args = parser.parse_args()
+
+    if args.action == 'migrate':
+        # convert an existing LMDB database to the raw vector format
+        with open(args.registry) as f:
+            registry = json.load(f)
+        envFilePath = os.path.join(registry["embedding-lmdb-path"], args.embedding)
+        if not os.path.isdir(envFilePath):
+            print("no LMDB database for embeddings", args.embedding, "under", registry["embedding-lmdb-path"])
+        else:
+            migrate_lmdb_embeddings(envFilePath)
+    else:
+        print('action not specifed, must be one of [migrate]')